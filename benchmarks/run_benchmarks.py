@@ -0,0 +1,145 @@
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from os.path import join
+from pydub import AudioSegment
+from scripts.audio_processor import AudioProcessor
+from scripts.map_generator import MapGenerator
+from scripts.map_processor import MapProcessor
+from .synthetic import SyntheticMap
+
+
+class Benchmark:
+    # Class to time one operation and measure its peak Python memory
+    def __init__(self, name, function, work, unit) -> None:
+        """
+        Parameters:
+        name (str): The name of the benchmark
+        function (callable): The operation to time, called without arguments
+        work (float): How much work one call does, used for the throughput
+        unit (str): The unit of the work (like "objects" or "audio seconds")
+        """
+        self.name = name
+        self.function = function
+        self.work = work
+        self.unit = unit
+
+    def run(self, repeat) -> dict:
+        # Warm up once so imports and caches don't count
+        self.function()
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self.function()
+            timings.append(time.perf_counter() - start)
+
+        # Memory is measured in a separate call because tracing slows the operation down
+        tracemalloc.start()
+        self.function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        best_time = min(timings)
+        return {"name": self.name,
+                "best_seconds": best_time,
+                "mean_seconds": sum(timings) / len(timings),
+                "throughput": self.work / best_time if best_time else None,
+                "throughput_unit": f"{self.unit}/s",
+                "peak_memory_mb": peak_memory / 1024 ** 2}
+
+
+def build_benchmarks(folder, arguments) -> list[Benchmark]:
+    """
+    Write the synthetic maps and build the benchmarks
+
+    Parameters:
+    folder (str): The folder to write the synthetic maps to
+    arguments (argparse.Namespace): The command line arguments
+
+    Returns:
+    list[Benchmark]: The benchmarks
+    """
+    map_paths = [SyntheticMap.write_map(join(folder, f"map{idx}"), arguments.objects, arguments.timing_points,
+                                        arguments.events, seed=idx)
+                 for idx in range(arguments.maps)]
+    map_path = map_paths[0]
+    sections = MapProcessor.read_osu_sections(map_path)
+    audio_path = join(folder, "map0", "audio.wav")
+    audio = AudioProcessor.load_audio(audio_path)
+    audio_seconds = len(audio) / 1000
+
+    map_queue = [(arguments.rate, False, None, None, path) for path in map_paths]
+    marathon_sections = MapGenerator.handle_map_queue(map_queue)
+    marathon_objects = arguments.objects * arguments.maps
+
+    def merge_maps():
+        MapProcessor.merge_maps(sections, marathon_sections["hitobjects"], marathon_sections["timing_points"],
+                                marathon_sections["events"], marathon_sections["bookmarks"], 2000,
+                                marathon_sections["first_and_last_objects"])
+
+    def generate_single_map():
+        new_file_path, new_file_contents = MapGenerator.generate_single_map(
+            arguments.rate, False, None, None, map_path)
+        MapGenerator.export_new_file(new_file_path, new_file_contents)
+
+    benchmarks = [
+        Benchmark("read_osu_sections", lambda: MapProcessor.read_osu_sections(map_path), arguments.objects, "objects"),
+        Benchmark("change_map_speed", lambda: MapProcessor.change_map_speed(sections, arguments.rate),
+                  arguments.objects, "objects"),
+        Benchmark("merge_maps", merge_maps, marathon_objects, "objects"),
+        Benchmark("change_speed", lambda: AudioProcessor.change_speed(audio, arguments.rate),
+                  audio_seconds, "audio seconds"),
+        Benchmark("generate_single_map", generate_single_map, audio_seconds, "audio seconds"),
+    ]
+    if shutil.which(AudioSegment.converter) and arguments.maps > 1:
+        benchmarks.append(Benchmark("generate_marathon",
+                                    lambda: MapGenerator.generate_marathon(map_queue, 2000, "Benchmark", "Marathon"),
+                                    audio_seconds * arguments.maps, "audio seconds"))
+    else:
+        print("Skipping generate_marathon: it needs ffmpeg to encode the mp3 and at least 2 maps.", file=sys.stderr)
+    return benchmarks
+
+
+def parse_arguments(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark Xerate's map and audio processing on synthetic maps.")
+    parser.add_argument("--objects", type=int, default=1000, help="Hit objects per map")
+    parser.add_argument("--timing-points", type=int, default=50, help="Timing points per map")
+    parser.add_argument("--events", type=int, default=500, help="Storyboard commands per map")
+    parser.add_argument("--maps", type=int, default=3, help="Maps in the marathon")
+    parser.add_argument("--rate", type=float, default=1.25, help="Rate to change the maps to")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark (the best one is reported)")
+    parser.add_argument("--only", nargs="*", default=None, help="Only run the benchmarks with these names")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    arguments = parse_arguments(argv)
+    folder = tempfile.mkdtemp(prefix="xerate_benchmark_")
+    try:
+        benchmarks = build_benchmarks(folder, arguments)
+        results = []
+        for benchmark in benchmarks:
+            if arguments.only and benchmark.name not in arguments.only:
+                continue
+            result = benchmark.run(arguments.repeat)
+            results.append(result)
+            print(f"{result['name']:<22} {result['best_seconds'] * 1000:>10.1f} ms "
+                  f"{result['throughput']:>14.1f} {result['throughput_unit']:<18} "
+                  f"{result['peak_memory_mb']:>8.1f} MB peak")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    if arguments.json:
+        with open(arguments.json, 'w', encoding='utf-8') as file:
+            json.dump({"arguments": vars(arguments), "results": results}, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from os.path import dirname
+
+REPOSITORY_DIRECTORY = dirname(dirname(os.path.abspath(__file__)))
+# Modules that must not be imported until an audio operation runs
+AUDIO_STACK_MODULES = ["pydub", "scripts.audio_encoder"]
+# The entry points whose import time is measured
+ENTRY_POINTS = ["scripts.gui", "scripts.cli", "scripts.beatmap_index"]
+
+# Run in a fresh interpreter, so nothing is imported yet
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "audio_stack": [name for name in {audio_stack!r} if name in sys.modules]}}))
+"""
+WINDOW_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from os.path import join, dirname
+import tkinter as tk
+import scripts.gui as gui
+gui.AudioProcessor.enable_audio_cache()
+gui.MapProcessor.enable_map_cache()
+try:
+    root = tk.Tk()
+except tk.TclError:
+    print(json.dumps({{"seconds": None, "audio_stack": []}}))
+    sys.exit()
+app = gui.XerateApp(root, join(dirname(gui.__file__), "Xerate.png"))
+root.update()
+elapsed = time.perf_counter() - start
+root.destroy()
+print(json.dumps({{"seconds": elapsed, "audio_stack": [name for name in {audio_stack!r} if name in sys.modules]}}))
+"""
+
+
+class StartupBenchmark:
+    # Class to time an import or the first window in fresh interpreters
+    def __init__(self, name, script, budget_seconds) -> None:
+        """
+        Parameters:
+        name (str): The name of the benchmark
+        script (str): The Python code to run, it prints the elapsed seconds and the loaded audio modules as JSON
+        budget_seconds (float): The best time allowed
+        """
+        self.name = name
+        self.script = script
+        self.budget_seconds = budget_seconds
+
+    def run_once(self) -> dict:
+        process = subprocess.run([sys.executable, "-c", self.script], cwd=REPOSITORY_DIRECTORY,
+                                 capture_output=True, text=True, check=True)
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+    def run(self, repeat) -> dict:
+        # The first run also warms the bytecode and file system caches, so it doesn't count
+        self.run_once()
+        runs = [self.run_once() for _ in range(repeat)]
+        timings = [run["seconds"] for run in runs if run["seconds"] is not None]
+        audio_stack = sorted({name for run in runs for name in run["audio_stack"]})
+
+        best_time = min(timings) if timings else None
+        return {"name": self.name,
+                "best_seconds": best_time,
+                "mean_seconds": sum(timings) / len(timings) if timings else None,
+                "budget_seconds": self.budget_seconds,
+                "audio_stack_loaded": audio_stack,
+                "passed": (best_time is None or best_time <= self.budget_seconds) and not audio_stack}
+
+
+def build_benchmarks(arguments) -> list[StartupBenchmark]:
+    benchmarks = [StartupBenchmark(f"import {module}",
+                                   IMPORT_SCRIPT.format(module=module, audio_stack=AUDIO_STACK_MODULES),
+                                   arguments.import_budget / 1000)
+                  for module in ENTRY_POINTS]
+    if not arguments.no_window:
+        benchmarks.append(StartupBenchmark("first window", WINDOW_SCRIPT.format(audio_stack=AUDIO_STACK_MODULES),
+                                           arguments.window_budget / 1000))
+    return benchmarks
+
+
+def parse_arguments(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark how fast Xerate's entry points import and the GUI appears.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark (the best one is reported)")
+    parser.add_argument("--import-budget", type=float, default=250, help="Budget of each import in milliseconds")
+    parser.add_argument("--window-budget", type=float, default=1000,
+                        help="Budget of the time to the first window in milliseconds")
+    parser.add_argument("--no-window", action="store_true", help="Don't open the GUI window")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    arguments = parse_arguments(argv)
+    results = []
+    for benchmark in build_benchmarks(arguments):
+        result = benchmark.run(arguments.repeat)
+        results.append(result)
+        if result["best_seconds"] is None:
+            print(f"{result['name']:<28} skipped (no display)")
+            continue
+        audio_stack = f" loaded {', '.join(result['audio_stack_loaded'])}" if result["audio_stack_loaded"] else ""
+        print(f"{result['name']:<28} {result['best_seconds'] * 1000:>8.1f} ms "
+              f"(budget {result['budget_seconds'] * 1000:.0f} ms) {'ok' if result['passed'] else 'FAILED'}{audio_stack}")
+
+    if arguments.json:
+        with open(arguments.json, 'w', encoding='utf-8') as file:
+            json.dump({"arguments": vars(arguments), "results": results}, file, indent=2)
+    # A failed budget fails the run, so the benchmark can guard startup time in scripts
+    return 0 if all(result["passed"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import os
+import random
+import wave
+from os.path import join
+import numpy as np
+
+AUDIO_FILENAME = "audio.wav"
+FRAME_RATE = 44100
+BEAT_LENGTH = 500
+
+
+class SyntheticMap:
+    # Class to write synthetic beatmaps and audio for benchmarks
+    @staticmethod
+    def write_map(folder, object_count=1000, timing_point_count=50, event_count=500, seed=0,
+                  version="Synthetic") -> str:
+        """
+        Write a synthetic .osu file with a mix of circles, sliders, spinners and hold notes
+
+        Parameters:
+        folder (str): The folder to write the map to
+        object_count (int): The number of hit objects
+        timing_point_count (int): The number of timing points (the first one is the only uninherited one)
+        event_count (int): The number of storyboard commands
+        seed (int): The seed of the random generator, the same seed writes the same map
+        version (str): The difficulty name
+
+        Returns:
+        str: The path of the map
+        """
+        generator = random.Random(seed)
+        os.makedirs(folder, exist_ok=True)
+
+        hit_objects = []
+        time = 1000
+        for _ in range(object_count):
+            kind = generator.random()
+            x, y = generator.randint(0, 512), generator.randint(0, 384)
+            if kind < 0.5:
+                hit_objects.append(f"{x},{y},{time},1,0,0:0:0:0:\n")
+                time += generator.choice([125, 250])
+            elif kind < 0.8:
+                slides = generator.randint(1, 3)
+                length = generator.choice([70, 140, 210.5])
+                hit_objects.append(f"{x},{y},{time},2,0,B|{x + 50}:{y}|{x + 100}:{y + 30},{slides},{length},"
+                                   f"0|0,0:0|0:0,0:0:0:0:\n")
+                time += 250 * slides
+            elif kind < 0.9:
+                hit_objects.append(f"256,192,{time},12,0,{time + 1000},0:0:0:0:\n")
+                time += 1250
+            else:
+                hit_objects.append(f"{x},192,{time},128,0,{time + 375}:0:0:0:0:\n")
+                time += 500
+        last_time = time
+
+        timing_points = [f"1000,{BEAT_LENGTH},4,2,0,60,1,0\n"]
+        for idx in range(1, timing_point_count):
+            point_time = 1000 + idx * (last_time - 1000) // max(timing_point_count, 1)
+            timing_points.append(f"{point_time},{generator.choice([-50, -100, -200])},4,2,0,60,0,0\n")
+
+        events = ['//Background and Video events\n', '0,0,"bg.jpg",0,0\n', '2,5000,7000\n',
+                  '//Storyboard Layer 0 (Background)\n', 'Sprite,Foreground,Centre,"sb/dot.png",320,240\n']
+        for idx in range(event_count):
+            start = 1000 + idx * (last_time - 1000) // max(event_count, 1)
+            events.append(f" F,0,{start},{start + 200},0,1\n")
+
+        lines = ['osu file format v14\n', '\n',
+                 '[General]\n', f'AudioFilename: {AUDIO_FILENAME}\n', 'AudioLeadIn: 0\n', 'PreviewTime: 1000\n',
+                 'Mode: 0\n', '\n',
+                 '[Editor]\n', 'Bookmarks: 1000,5000,10000\n', 'DistanceSpacing: 1\n', '\n',
+                 '[Metadata]\n', 'Title:Synthetic\n', 'TitleUnicode:Synthetic\n', 'Artist:Xerate\n',
+                 'Creator:Xerate\n', f'Version:{version}\n', '\n',
+                 '[Difficulty]\n', 'HPDrainRate:5\n', 'CircleSize:4\n', 'OverallDifficulty:8\n',
+                 'ApproachRate:9\n', 'SliderMultiplier:1.4\n', 'SliderTickRate:1\n', '\n',
+                 '[Events]\n', *events, '\n',
+                 '[TimingPoints]\n', *timing_points, '\n',
+                 '[HitObjects]\n', *hit_objects]
+
+        file_path = join(folder, f"Xerate - Synthetic ({version}).osu")
+        with open(file_path, 'w', encoding='utf-8') as file:
+            file.writelines(lines)
+
+        # Make the audio long enough for the whole map
+        SyntheticMap.write_audio(join(folder, AUDIO_FILENAME), last_time / 1000 + 2)
+        return file_path
+
+    @staticmethod
+    def write_audio(file_path, duration_seconds, channels=2) -> str:
+        """
+        Write a synthetic 16-bit WAV file with a few mixed tones
+
+        Parameters:
+        file_path (str): The path of the audio file
+        duration_seconds (float): The length of the audio
+        channels (int): The number of channels
+
+        Returns:
+        str: The path of the audio file
+        """
+        time = np.arange(int(duration_seconds * FRAME_RATE)) / FRAME_RATE
+        tone = 0.3 * np.sin(2 * np.pi * 440 * time) + 0.2 * np.sin(2 * np.pi * 1234 * time)
+        samples = np.repeat((tone * 32767 * 0.8).astype(np.int16)[:, None], channels, axis=1)
+        with wave.open(file_path, 'wb') as file:
+            file.setnchannels(channels)
+            file.setsampwidth(2)
+            file.setframerate(FRAME_RATE)
+            file.writeframes(samples.tobytes())
+        return file_path
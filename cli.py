@@ -0,0 +1,7 @@
+import sys
+from multiprocessing import freeze_support
+from scripts.cli import main
+if __name__ == "__main__":
+    # Needed for the worker processes of frozen builds
+    freeze_support()
+    sys.exit(main())
\ No newline at end of file
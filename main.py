@@ -1,3 +1,6 @@
+from multiprocessing import freeze_support
 from scripts.gui import main
 if __name__ == "__main__":
+    # Needed for the worker processes of frozen builds
+    freeze_support()
     main()
\ No newline at end of file
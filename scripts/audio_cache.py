@@ -0,0 +1,133 @@
+import hashlib
+import os
+import struct
+import tempfile
+from os.path import join, getsize
+
+# frame_rate, channels, sample_width
+HEADER = struct.Struct('<III')
+CACHE_EXTENSION = '.pcm'
+DEFAULT_CACHE_DIRECTORY = join(tempfile.gettempdir(), "Xerate", "audio_cache")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+class AudioCache:
+    # Class to keep decoded audio on disk so the same song doesn't have to be decoded again
+    def __init__(self, cache_directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES,
+                 extensions=(CACHE_EXTENSION,)) -> None:
+        """
+        Parameters:
+        cache_directory (str): The folder to store the decoded audio in
+        max_bytes (int): The maximum size of the cache. The least recently used entries are removed past it.
+        extensions (tuple[str]): The files of the folder that count towards max_bytes and can be evicted
+        """
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+        self.extensions = extensions
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(audio_file_path) -> str:
+        """
+        Get the cache key of an audio file from its path, size, modification time and content
+
+        Parameters:
+        audio_file_path (str): The path of the audio file
+
+        Returns:
+        str: The cache key
+        """
+        file_stat = os.stat(audio_file_path)
+        content_hash = hashlib.sha1()
+        with open(audio_file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                content_hash.update(chunk)
+        key = f"{os.path.abspath(audio_file_path)}|{file_stat.st_size}|{file_stat.st_mtime_ns}|{content_hash.hexdigest()}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_path(self, key) -> str:
+        return join(self.cache_directory, key + CACHE_EXTENSION)
+
+    def get(self, audio_file_path) -> tuple[bytes, int, int, int] or None:
+        """
+        Get the decoded audio of a file if it is in the cache
+
+        Parameters:
+        audio_file_path (str): The path of the audio file
+
+        Returns:
+        tuple[bytes, int, int, int]: The PCM data, frame rate, channels and sample width (None if it isn't cached)
+        """
+        return self.read(self.get_key(audio_file_path))
+
+    def read(self, key) -> tuple[bytes, int, int, int] or None:
+        # Get the PCM data stored under a key (None if there is none)
+        cache_path = self.get_path(key)
+        try:
+            with open(cache_path, 'rb') as file:
+                frame_rate, channels, sample_width = HEADER.unpack(file.read(HEADER.size))
+                raw_data = file.read()
+        except (FileNotFoundError, struct.error):
+            return None
+
+        # Mark the entry as recently used
+        os.utime(cache_path)
+        return raw_data, frame_rate, channels, sample_width
+
+    def put(self, audio_file_path, raw_data, frame_rate, channels, sample_width) -> None:
+        """
+        Store the decoded audio of a file and evict the least recently used entries if the cache is full
+
+        Parameters:
+        audio_file_path (str): The path of the audio file
+        raw_data (bytes): The decoded PCM data
+        frame_rate (int): The frame rate of the PCM data
+        channels (int): The number of channels of the PCM data
+        sample_width (int): The sample width of the PCM data in bytes
+        """
+        self.write(self.get_key(audio_file_path), raw_data, frame_rate, channels, sample_width)
+
+    def write(self, key, raw_data, frame_rate, channels, sample_width) -> None:
+        # Store PCM data (bytes or any contiguous buffer, like a NumPy array) under a key
+        if HEADER.size + memoryview(raw_data).nbytes > self.max_bytes:
+            return
+
+        cache_path = self.get_path(key)
+        # Write to a temporary file first so other processes never read a half written entry
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                file.write(HEADER.pack(frame_rate, channels, sample_width))
+                file.write(raw_data)
+            os.replace(temporary_path, cache_path)
+        except Exception:
+            os.remove(temporary_path)
+            raise
+
+        self.evict()
+
+    def evict(self) -> None:
+        # Remove the least recently used entries until the cache fits in its budget
+        entries = []
+        for file_name in os.listdir(self.cache_directory):
+            if file_name.endswith(self.extensions):
+                cache_path = join(self.cache_directory, file_name)
+                try:
+                    entries.append((os.path.getmtime(cache_path), getsize(cache_path), cache_path))
+                except FileNotFoundError:
+                    continue
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, cache_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(cache_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def clear(self) -> None:
+        for file_name in os.listdir(self.cache_directory):
+            if file_name.endswith(CACHE_EXTENSION):
+                os.remove(join(self.cache_directory, file_name))
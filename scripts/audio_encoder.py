@@ -0,0 +1,158 @@
+import os
+import subprocess
+import tempfile
+import numpy as np
+from pydub import AudioSegment
+from pydub.exceptions import CouldntEncodeError
+
+# The raw PCM format ffmpeg should read for each sample width
+PCM_FORMATS = {1: 's8', 2: 's16le', 3: 's24le', 4: 's32le'}
+
+
+class PcmEncoder:
+    # Class to encode raw PCM into an audio file by streaming it into ffmpeg's stdin
+    def __init__(self, output_file, frame_rate, channels, sample_width, audio_format='mp3') -> None:
+        """
+        Parameters:
+        output_file (str): The path of the audio file to write
+        frame_rate (int): The frame rate of the PCM data that will be written
+        channels (int): The number of channels of the PCM data
+        sample_width (int): The sample width of the PCM data in bytes
+        audio_format (str): The format of the output file
+        """
+        self.output_file = output_file
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.audio_format = audio_format
+        self.process = None
+        self.error_log = None
+
+    def __enter__(self) -> "PcmEncoder":
+        self.open()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        if exception_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def get_command(self, input_file) -> list[str]:
+        # The ffmpeg command that encodes the raw PCM of input_file
+        return [AudioSegment.converter, '-y', '-loglevel', 'error',
+                '-f', PCM_FORMATS[self.sample_width],
+                '-ar', str(self.frame_rate),
+                '-ac', str(self.channels),
+                '-i', input_file,
+                '-f', self.audio_format, self.output_file]
+
+    def open(self) -> None:
+        # ffmpeg's log goes to a file so a full stderr pipe can never block the encoder
+        self.error_log = tempfile.TemporaryFile()
+        try:
+            self.process = subprocess.Popen(self.get_command('pipe:0'),
+                                            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.error_log)
+        except BaseException:
+            # Without ffmpeg there is nothing to abort, only the log to close
+            self.error_log.close()
+            self.error_log = None
+            raise
+
+    def write(self, raw_data) -> None:
+        self.process.stdin.write(raw_data)
+
+    def write_audio(self, audio) -> None:
+        # Convert the segment to the format of the encoder before streaming it
+        audio = (
+            audio.set_frame_rate(self.frame_rate)
+                 .set_channels(self.channels)
+                 .set_sample_width(self.sample_width)
+        )
+        self.write(audio.raw_data)
+
+    def write_samples(self, samples, frame_rate) -> None:
+        """
+        Write a (frames, channels) array of samples. Samples in the format of the encoder are written
+        straight from the array, the others are converted like write_audio() does.
+
+        Parameters:
+        samples (np.ndarray): The samples
+        frame_rate (int): The frame rate of the samples
+        """
+        channels, sample_width = samples.shape[1], samples.dtype.itemsize
+        if (frame_rate, channels, sample_width) == (self.frame_rate, self.channels, self.sample_width):
+            self.write(np.ascontiguousarray(samples))
+        else:
+            self.write_audio(AudioSegment(data=samples.tobytes(), sample_width=sample_width,
+                                          frame_rate=frame_rate, channels=channels))
+
+    def write_silence(self, duration_ms) -> None:
+        # Generate the silence one second at a time instead of allocating it all at once
+        frame_width = self.channels * self.sample_width
+        remaining_frames = int(self.frame_rate * duration_ms / 1000)
+        while remaining_frames > 0:
+            frame_count = min(remaining_frames, self.frame_rate)
+            self.write(bytes(frame_count * frame_width))
+            remaining_frames -= frame_count
+
+    def close(self) -> None:
+        self.process.stdin.close()
+        return_code = self.process.wait()
+        self.error_log.seek(0)
+        error_output = self.error_log.read().decode('utf-8', errors='replace')
+        self.error_log.close()
+        if return_code != 0:
+            raise CouldntEncodeError(
+                f"Encoding {self.output_file} failed with code {return_code}:\n{error_output}")
+
+    def abort(self) -> None:
+        # Safe to call on an encoder that never opened
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+        if self.error_log is not None:
+            self.error_log.close()
+
+
+class PcmSpool(PcmEncoder):
+    # Class to append raw PCM to a spool file on disk and encode the whole file with ffmpeg once it is closed.
+    # Nothing waits for the encoder while the audio is prepared, and no audio is kept in memory.
+    def __init__(self, output_file, frame_rate, channels, sample_width, audio_format='mp3',
+                 spool_directory=None) -> None:
+        """
+        Parameters:
+        output_file (str): The path of the audio file to write
+        frame_rate (int): The frame rate of the PCM data that will be written
+        channels (int): The number of channels of the PCM data
+        sample_width (int): The sample width of the PCM data in bytes
+        audio_format (str): The format of the output file
+        spool_directory (str): The folder of the spool file (None uses the temporary folder)
+        """
+        super().__init__(output_file, frame_rate, channels, sample_width, audio_format)
+        self.spool_directory = spool_directory
+        self.spool_file = None
+
+    def open(self) -> None:
+        self.spool_file = tempfile.NamedTemporaryFile(dir=self.spool_directory, suffix='.pcm', delete=False)
+
+    def write(self, raw_data) -> None:
+        self.spool_file.write(raw_data)
+
+    def close(self) -> None:
+        self.spool_file.close()
+        try:
+            # ffmpeg reads the spool file itself, so its content never passes through this process again
+            process = subprocess.run(self.get_command(self.spool_file.name),
+                                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        finally:
+            os.remove(self.spool_file.name)
+        if process.returncode != 0:
+            raise CouldntEncodeError(
+                f"Encoding {self.output_file} failed with code {process.returncode}:\n"
+                f"{process.stderr.decode('utf-8', errors='replace')}")
+
+    def abort(self) -> None:
+        if self.spool_file is not None:
+            self.spool_file.close()
+            os.remove(self.spool_file.name)
@@ -1,9 +1,33 @@
 import os
-from pydub import AudioSegment
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+import numpy as np
+from .audio_cache import AudioCache, DEFAULT_CACHE_DIRECTORY, DEFAULT_MAX_BYTES
+from .instrumentation import Instrumentation
+from .job import check_cancelled, report_progress
+from .resampler import Resampler, DEFAULT_QUALITY, SAMPLE_TYPES
+
+if TYPE_CHECKING:
+    # Only for the annotations, pydub itself is imported when audio is processed
+    from pydub import AudioSegment
+
+
+# Engines that can change the speed of a map's audio
+PYDUB_ENGINE = "pydub"
+FFMPEG_ENGINE = "ffmpeg"
+# The most marathon tracks decoded ahead of the encoder. Every one of them is held in memory until it is encoded.
+MAX_AUDIO_LOOKAHEAD = 2
 
 
 class AudioProcessor:
     # Class to process audio
+    # pydub and the encoder are imported by the methods that use them, so starting the GUI or
+    # running a command that only reads maps doesn't load the audio stack
+    # Decoded audio is only cached on disk once enable_audio_cache() is called
+    audio_cache = None
+
     def __init__(self) -> None:
         # Get the path of ffmpeg and add it to PATH
         ffmpeg_path = os.path.join(os.path.dirname(
@@ -11,28 +35,133 @@ class AudioProcessor:
         os.environ["PATH"] += os.pathsep + ffmpeg_path
 
     @staticmethod
-    def change_speed(input_audio, speed_factor) -> AudioSegment:
+    def enable_audio_cache(cache_directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES) -> None:
+        """
+        Keep decoded audio on disk so repeated decodes of the same file become a file read
+
+        Parameters:
+        cache_directory (str): The folder to store the decoded audio in
+        max_bytes (int): The maximum size of the cache in bytes
+        """
+        AudioProcessor.set_audio_cache(AudioCache(cache_directory, max_bytes))
+
+    @staticmethod
+    def set_audio_cache(audio_cache) -> None:
+        # Also used to pass the cache on to worker processes
+        AudioProcessor.audio_cache = audio_cache
+
+    @staticmethod
+    def disable_audio_cache() -> None:
+        AudioProcessor.audio_cache = None
+
+    @staticmethod
+    @Instrumentation.timed("load_audio")
+    def load_audio(audio_file_path) -> "AudioSegment":
+        # Decode the audio once so it can be reused for several rates
+        from pydub import AudioSegment
+        audio_cache = AudioProcessor.audio_cache
+        if audio_cache is None:
+            return AudioSegment.from_file(audio_file_path)
+
+        cached_audio = audio_cache.get(audio_file_path)
+        if cached_audio is not None:
+            raw_data, frame_rate, channels, sample_width = cached_audio
+            return AudioSegment(data=raw_data, sample_width=sample_width,
+                                frame_rate=frame_rate, channels=channels)
+
+        audio = AudioSegment.from_file(audio_file_path)
+        audio_cache.put(audio_file_path, audio.raw_data, audio.frame_rate,
+                        audio.channels, audio.sample_width)
+        return audio
+
+    @staticmethod
+    @Instrumentation.timed("change_speed")
+    def change_speed(input_audio, speed_factor, quality=DEFAULT_QUALITY) -> "AudioSegment":
+        from pydub import AudioSegment
         # If the AudioSegment is not already loaded, load it
         if not isinstance(input_audio, AudioSegment):
-            audio = AudioSegment.from_file(input_audio)
+            audio = AudioProcessor.load_audio(input_audio)
         else:
             audio = input_audio
 
-        # Change the frame rate, which correlates to the speed.
+        # Playing the samples at a different frame rate changes the speed,
+        # so resample them from that frame rate back to the original one
+        adjusted_frame_rate = int(audio.frame_rate * speed_factor)
+        if Resampler.can_resample(audio.sample_width):
+            return audio._spawn(Resampler.resample_raw_data(audio.raw_data, audio.sample_width, audio.channels,
+                                                            adjusted_frame_rate, audio.frame_rate, quality))
+
+        # 24-bit audio has no NumPy type, so let pydub resample it
         adjusted_audio = audio._spawn(audio.raw_data, overrides={
-            "frame_rate": int(audio.frame_rate * speed_factor)
+            "frame_rate": adjusted_frame_rate
         })
+        return adjusted_audio.set_frame_rate(audio.frame_rate)
+
+    @staticmethod
+    def get_samples(audio) -> np.ndarray:
+        # A read only (frames, channels) view of the PCM data of a segment, nothing is copied
+        return np.frombuffer(audio.raw_data, dtype=SAMPLE_TYPES[audio.sample_width]).reshape(-1, audio.channels)
+
+    @staticmethod
+    @Instrumentation.timed("change_speed")
+    def change_samples_speed(samples, frame_rate, speed_factor, quality=DEFAULT_QUALITY) -> np.ndarray:
+        """
+        Change the speed of a (frames, channels) array of samples the same way change_speed() does
 
-        # Set the channels and frame rate to the original audio
-        adjusted_audio = (
-            adjusted_audio.set_frame_rate(audio.frame_rate)
-                          .set_channels(audio.channels)
-        )
+        Parameters:
+        samples (np.ndarray): The samples
+        frame_rate (int): The frame rate of the samples
+        speed_factor (float): The rate to change the speed to
+        quality (str): The quality of the resampler
 
-        return adjusted_audio
+        Returns:
+        np.ndarray: The new samples (the same array when the speed doesn't change)
+        """
+        if speed_factor == 1.0:
+            return samples
+        return Resampler.resample_samples(samples, int(frame_rate * speed_factor), frame_rate, quality)
 
     @staticmethod
-    def crop_audio(audio, start_ms, end_ms, fade_duration=500) -> AudioSegment:
+    @Instrumentation.timed("crop_audio")
+    def crop_samples(samples, frame_rate, start_ms, end_ms, fade_duration=500) -> np.ndarray:
+        """
+        Crop a (frames, channels) array of samples and fade its end out
+
+        Parameters:
+        samples (np.ndarray): The samples
+        frame_rate (int): The frame rate of the samples
+        start_ms (float): The start of the crop
+        end_ms (float): The end of the crop
+        fade_duration (int): The length of the fade out in milliseconds
+
+        Returns:
+        np.ndarray: A view of the samples, faded out in place. Read only samples are copied first.
+        """
+        start_frame = min(max(int(start_ms * frame_rate / 1000), 0), len(samples))
+        end_frame = min(max(int(end_ms * frame_rate / 1000), start_frame), len(samples))
+        cropped_samples = samples[start_frame:end_frame]
+
+        if fade_duration > 0 and len(cropped_samples):
+            if not cropped_samples.flags.writeable:
+                cropped_samples = cropped_samples.copy()
+            fade_frame_count = min(int(fade_duration * frame_rate / 1000), len(cropped_samples))
+            AudioProcessor.fade_out_samples(cropped_samples[len(cropped_samples) - fade_frame_count:])
+        return cropped_samples
+
+    @staticmethod
+    def fade_out_samples(samples) -> None:
+        # Fade the samples out in place with a gain going linearly from 1 to 0
+        gain = np.linspace(1, 0, len(samples), endpoint=False, dtype=np.float32)
+        np.multiply(samples, gain[:, None], out=samples, casting='unsafe')
+
+    @staticmethod
+    def crop_audio(audio, start_ms, end_ms, fade_duration=500) -> "AudioSegment":
+        if Resampler.can_resample(audio.sample_width):
+            cropped_samples = AudioProcessor.crop_samples(AudioProcessor.get_samples(audio), audio.frame_rate,
+                                                          start_ms, end_ms, fade_duration)
+            return audio._spawn(cropped_samples.tobytes())
+
+        # 24-bit audio has no NumPy type, so let pydub crop it
         # Crop the audio
         cropped_audio = audio[start_ms:end_ms]
 
@@ -44,25 +173,161 @@ class AudioProcessor:
         return cropped_audio
 
     @staticmethod
-    def merge_audio_files_with_breaks(audio_files, output_file, break_duration_ms, audio_cuts, map_queue) -> None:
-        merged_audio = AudioSegment.empty()
+    @Instrumentation.timed("merge_audio_files_with_breaks")
+    def merge_audio_files_with_breaks(audio_files, output_file, break_duration_ms, audio_cuts, rates,
+                                      progress=None, cancellation_token=None, marathon_cache=None,
+                                      spool_directory=None, max_workers=None) -> None:
+        """
+        Change the speed of, crop and merge the audio of marathon maps with a silence between them
+
+        Parameters:
+        audio_files (list[str]): The audio file of every map
+        output_file (str): The path of the merged mp3
+        break_duration_ms (int): The length of the silences in milliseconds
+        audio_cuts (list[tuple[float, float]]): Where to crop every rate changed audio in milliseconds
+        rates (list[float]): The rate of every map
+        progress (callable): Called as progress(stage, current, total) after each map.
+        cancellation_token (CancellationToken): Stops between maps with JobCancelledError once cancelled.
+        marathon_cache (MarathonCache): Reuses the segments that were already made. Can be None.
+        spool_directory (str): Spool the audio to a file in this folder before encoding it (None streams it into the encoder).
+        max_workers (int): The number of segments prepared ahead of the encoder, at most MAX_AUDIO_LOOKAHEAD (None uses the most)
+        """
+        # Each track is streamed into the encoder as soon as it is ready, so only the tracks prepared ahead are in memory.
+        # With a spool_directory the tracks are appended to a spool file there and encoded once they are all ready.
+        # Decoding runs in ffmpeg and resampling in NumPy, so worker threads prepare the next tracks in parallel.
+        from .audio_encoder import PcmEncoder, PcmSpool
+        lookahead = min(max_workers or MAX_AUDIO_LOOKAHEAD, MAX_AUDIO_LOOKAHEAD)
+        encoder = None
+        with ThreadPoolExecutor(max_workers=lookahead) as executor:
+            futures = deque()
+            try:
+                for i, file_path in enumerate(audio_files):
+                    check_cancelled(cancellation_token)
+                    report_progress(progress, "Processing audio", i, len(audio_files))
+                    for next_index in range(i + len(futures), min(i + lookahead, len(audio_files))):
+                        futures.append(executor.submit(AudioProcessor.get_marathon_segment, audio_files[next_index],
+                                                       rates[next_index], audio_cuts[next_index], marathon_cache))
+
+                    with Instrumentation.stage("wait_for_map_audio", map=i, file=file_path):
+                        samples, frame_rate = futures.popleft().result()
+                    channels, sample_width = samples.shape[1], samples.dtype.itemsize
 
-        for i, file_path in enumerate(audio_files):
-            # Load the audio
-            audio = AudioSegment.from_file(file_path)
-            audio_start, audio_end = audio_cuts[i]
-            audio = AudioProcessor.change_speed(audio, map_queue[i][0])
-            audio = AudioProcessor.crop_audio(audio, audio_start, audio_end)
+                    # The first track decides the format of the whole marathon
+                    if encoder is None:
+                        if spool_directory is not None:
+                            new_encoder = PcmSpool(output_file, frame_rate, channels, sample_width,
+                                                   spool_directory=spool_directory)
+                        else:
+                            new_encoder = PcmEncoder(output_file, frame_rate, channels, sample_width)
+                        # Only an encoder that opened is aborted, so a missing ffmpeg raises its own error
+                        new_encoder.open()
+                        encoder = new_encoder
+                    # Writing blocks while ffmpeg encodes, so this is mostly encoding time
+                    with Instrumentation.stage("encode_audio", map=i):
+                        encoder.write_samples(samples, frame_rate)
 
-            merged_audio += audio
+                        if i < len(audio_files) - 1:
+                            encoder.write_silence(break_duration_ms)
+            except BaseException:
+                # Tracks that haven't started yet are dropped, the running ones are left to finish
+                for future in futures:
+                    future.cancel()
+                if encoder is not None:
+                    encoder.abort()
+                raise
 
-            if i < len(audio_files) - 1:
-                merged_audio += AudioSegment.silent(duration=break_duration_ms)
+        report_progress(progress, "Processing audio", len(audio_files), len(audio_files))
+        if encoder is not None:
+            # Wait for ffmpeg to encode what is left in the pipe
+            report_progress(progress, "Encoding audio", 0, 1)
+            with Instrumentation.stage("encode_audio_finish"):
+                encoder.close()
+            report_progress(progress, "Encoding audio", 1, 1)
 
-        merged_audio.export(output_file, format='mp3')
+    @staticmethod
+    @Instrumentation.timed("marathon_map_audio")
+    def get_marathon_segment(audio_file_path, rate, audio_cut, marathon_cache=None) -> tuple[np.ndarray, int]:
+        """
+        Get the rate changed and cropped audio of a marathon map.
+        The samples are only copied by the resampler, the crop and fade work on views of its output.
+
+        Parameters:
+        audio_file_path (str): The path of the original audio
+        rate (float): The rate to change the audio speed to
+        audio_cut (tuple[float, float]): Where to crop the rate changed audio in milliseconds
+        marathon_cache (MarathonCache): Reuses the segment if it was already made from the same audio. Can be None.
+
+        Returns:
+        np.ndarray: The samples of the segment as a (frames, channels) array
+        int: The frame rate of the segment
+        """
+        audio_start, audio_end = audio_cut
+        if marathon_cache is not None:
+            cached_segment = marathon_cache.get_segment(audio_file_path, rate, audio_start, audio_end)
+            if cached_segment is not None:
+                raw_data, frame_rate, channels, sample_width = cached_segment
+                return np.frombuffer(raw_data, dtype=SAMPLE_TYPES[sample_width]).reshape(-1, channels), frame_rate
+
+        # Load the audio
+        audio = AudioProcessor.load_audio(audio_file_path)
+        if not Resampler.can_resample(audio.sample_width):
+            # 24-bit audio has no NumPy type, the encoder gets it as 32-bit samples instead
+            audio = audio.set_sample_width(4)
+        samples = AudioProcessor.change_samples_speed(AudioProcessor.get_samples(audio), audio.frame_rate, rate)
+        samples = AudioProcessor.crop_samples(samples, audio.frame_rate, audio_start, audio_end)
+        if marathon_cache is not None:
+            marathon_cache.put_segment(audio_file_path, rate, audio_start, audio_end, samples,
+                                       audio.frame_rate, samples.shape[1], samples.dtype.itemsize)
+        return samples, audio.frame_rate
 
     @staticmethod
-    def generate_map_audio(audio_file_path, new_audio_file_path, rate) -> None:
+    @Instrumentation.timed("generate_map_audio")
+    def generate_map_audio(audio_file_path, new_audio_file_path, rate, engine=PYDUB_ENGINE) -> None:
+        from pydub import AudioSegment
+        # The ffmpeg engine needs the path of the audio, it can't use an already loaded AudioSegment
+        if engine == FFMPEG_ENGINE and not isinstance(audio_file_path, AudioSegment):
+            AudioProcessor.generate_map_audio_with_ffmpeg(
+                audio_file_path, new_audio_file_path, rate)
+            return
+
+        # audio_file_path can also be an already loaded AudioSegment
         new_audio = AudioProcessor.change_speed(audio_file_path, rate)
         audio_format = new_audio_file_path.split('.')[-1]
-        new_audio.export(new_audio_file_path, format=audio_format)
+        # Export next to the target and rename it so parallel exports of the same file never mix
+        temporary_audio_file_path = f"{new_audio_file_path}.{os.getpid()}.tmp"
+        with Instrumentation.stage("export_audio", file=new_audio_file_path):
+            new_audio.export(temporary_audio_file_path, format=audio_format)
+        os.replace(temporary_audio_file_path, new_audio_file_path)
+
+    @staticmethod
+    @Instrumentation.timed("generate_map_audio_with_ffmpeg")
+    def generate_map_audio_with_ffmpeg(audio_file_path, new_audio_file_path, rate) -> None:
+        """
+        Decode, change the speed of and encode an audio file in a single ffmpeg process.
+        The speed is changed the same way as change_speed(), so the pitch changes with the rate.
+
+        Parameters:
+        audio_file_path (str): The path of the original audio
+        new_audio_file_path (str): The path to export the new audio to
+        rate (float): The rate to change the audio speed to
+        """
+        from pydub import AudioSegment
+        from pydub.exceptions import CouldntEncodeError
+        from pydub.utils import mediainfo
+        frame_rate = int(mediainfo(audio_file_path)["sample_rate"])
+        audio_format = new_audio_file_path.split('.')[-1]
+        temporary_audio_file_path = f"{new_audio_file_path}.{os.getpid()}.tmp"
+
+        # Play the samples at a different frame rate, then resample back to the original one
+        process = subprocess.run([AudioSegment.converter, '-y', '-loglevel', 'error',
+                                  '-i', audio_file_path,
+                                  '-vn', '-af', f"asetrate={int(frame_rate * rate)},aresample={frame_rate}",
+                                  '-f', audio_format, temporary_audio_file_path],
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            if os.path.exists(temporary_audio_file_path):
+                os.remove(temporary_audio_file_path)
+            raise CouldntEncodeError(
+                f"Encoding {new_audio_file_path} failed with code {process.returncode}:\n"
+                f"{process.stderr.decode('utf-8', errors='replace')}")
+        os.replace(temporary_audio_file_path, new_audio_file_path)
@@ -0,0 +1,241 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+from os import environ
+from os.path import join
+from .job import check_cancelled, report_progress
+from .map_cache import ParsedMap
+from .map_processor import MapProcessor
+
+DEFAULT_INDEX_PATH = join(tempfile.gettempdir(), "Xerate", "beatmap_index.sqlite3")
+# The sections an index entry is built from
+INDEXED_SECTIONS = ["General", "Metadata", "Difficulty", "Events", "TimingPoints", "HitObjects"]
+# The columns of an index entry, the path first
+COLUMNS = ["path", "mtime_ns", "size", "artist", "title", "creator", "version", "audio_file",
+           "min_bpm", "max_bpm", "object_count", "drain_length_ms"]
+
+
+class BeatmapIndex:
+    # Class to keep the metadata of every .osu file of a Songs folder in SQLite, so maps can be searched without opening them
+    def __init__(self, database_path=DEFAULT_INDEX_PATH) -> None:
+        """
+        Parameters:
+        database_path (str): The path of the SQLite database. It is created if it doesn't exist.
+        """
+        database_directory = os.path.dirname(database_path)
+        if database_directory:
+            os.makedirs(database_directory, exist_ok=True)
+        self.connection = sqlite3.connect(database_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS beatmaps ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, artist TEXT, title TEXT, creator TEXT, "
+            "version TEXT, audio_file TEXT, min_bpm REAL, max_bpm REAL, object_count INTEGER, drain_length_ms INTEGER)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS beatmaps_bpm ON beatmaps (min_bpm, max_bpm)")
+        self.connection.commit()
+
+    def __enter__(self) -> "BeatmapIndex":
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @staticmethod
+    def get_default_songs_directory() -> str or None:
+        local_app_data = environ.get("localappdata")
+        return join(local_app_data, "osu!", "Songs") if local_app_data else None
+
+    @staticmethod
+    def find_beatmaps(songs_directory):
+        # Yield the path and stat of every .osu file under the folder
+        for directory, _, file_names in os.walk(songs_directory):
+            for file_name in file_names:
+                if file_name.lower().endswith('.osu'):
+                    file_path = join(directory, file_name)
+                    try:
+                        yield file_path, os.stat(file_path)
+                    except OSError:
+                        continue
+
+    @staticmethod
+    def read_beatmap(file_path) -> dict:
+        """
+        Read the metadata of an .osu file
+
+        Parameters:
+        file_path (str): The path of the .osu file
+
+        Returns:
+        dict: The artist, title, creator, version, audio_file, min_bpm, max_bpm, object_count and drain_length_ms
+        """
+        file_sections = MapProcessor.read_osu_sections(file_path, INDEXED_SECTIONS)
+        if not file_sections:
+            raise ValueError(f"Could not read {file_path}.")
+        general_section = file_sections.get("General", [])
+        metadata_section = file_sections.get("Metadata", [])
+
+        parsed_map = ParsedMap.from_sections(file_sections)
+        beats_per_minute = parsed_map.timing_index.bpms.tolist()
+        hit_objects = [line for line in file_sections.get("HitObjects", [])[1:] if line.strip()]
+
+        return {
+            "artist": MapProcessor.get_variable(metadata_section, "Artist"),
+            "title": MapProcessor.get_variable(metadata_section, "Title"),
+            "creator": MapProcessor.get_variable(metadata_section, "Creator"),
+            "version": MapProcessor.get_variable(metadata_section, "Version"),
+            "audio_file": MapProcessor.get_variable(general_section, "AudioFilename"),
+            "min_bpm": min(beats_per_minute) if beats_per_minute else None,
+            "max_bpm": max(beats_per_minute) if beats_per_minute else None,
+            "object_count": len(hit_objects),
+            "drain_length_ms": int(parsed_map.get_drain_length()),
+        }
+
+    def scan(self, songs_directory, progress=None, cancellation_token=None) -> dict:
+        """
+        Add the .osu files of a folder to the index. Only new files and files whose modification time or size
+        changed are read again, and files that were removed from the folder are removed from the index.
+
+        Parameters:
+        songs_directory (str): The folder to scan (usually the osu! Songs folder)
+        progress (callable): Called as progress(stage, current, total) while the changed files are read.
+        cancellation_token (CancellationToken): Stops the scan with JobCancelledError once cancelled. What was read is kept.
+
+        Returns:
+        dict: How many files were read, left unchanged, removed and failed to read
+        """
+        songs_directory = os.path.abspath(songs_directory)
+        indexed_files = {row["path"]: (row["mtime_ns"], row["size"]) for row in self.connection.execute(
+            "SELECT path, mtime_ns, size FROM beatmaps WHERE path LIKE ? ESCAPE '\\'",
+            (self.escape_like(join(songs_directory, '')) + '%',))}
+
+        changed_files = []
+        unchanged_count = 0
+        for file_path, file_stat in self.find_beatmaps(songs_directory):
+            if indexed_files.pop(file_path, None) == (file_stat.st_mtime_ns, file_stat.st_size):
+                unchanged_count += 1
+            else:
+                changed_files.append((file_path, file_stat))
+
+        # What is left wasn't found in the folder anymore
+        self.connection.executemany("DELETE FROM beatmaps WHERE path = ?", [(path,) for path in indexed_files])
+        self.connection.commit()
+
+        failed_count = 0
+        rows = []
+        try:
+            for idx, (file_path, file_stat) in enumerate(changed_files):
+                check_cancelled(cancellation_token)
+                report_progress(progress, "Indexing maps", idx, len(changed_files))
+                try:
+                    beatmap = self.read_beatmap(file_path)
+                except Exception:
+                    # Broken or very old maps are left out instead of stopping the scan
+                    failed_count += 1
+                    continue
+                rows.append([file_path, file_stat.st_mtime_ns, file_stat.st_size,
+                             *(beatmap[column] for column in COLUMNS[3:])])
+        finally:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO beatmaps ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows)
+            self.connection.commit()
+        report_progress(progress, "Indexing maps", len(changed_files), len(changed_files))
+
+        return {"read": len(rows), "unchanged": unchanged_count, "removed": len(indexed_files), "failed": failed_count}
+
+    @staticmethod
+    def escape_like(text) -> str:
+        return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    def search(self, text=None, min_bpm=None, max_bpm=None, min_length_ms=None, max_length_ms=None,
+               limit=None) -> list[dict]:
+        """
+        Search the index
+
+        Parameters:
+        text (str): Only maps with this text in their artist, title, creator or version (case insensitive)
+        min_bpm (float): Only maps whose highest BPM is at least this
+        max_bpm (float): Only maps whose lowest BPM is at most this
+        min_length_ms (int): Only maps with at least this drain length
+        max_length_ms (int): Only maps with at most this drain length
+        limit (int): The maximum number of maps to return
+
+        Returns:
+        list[dict]: The maps, sorted by artist, title and version
+        """
+        conditions = []
+        parameters = []
+        if text:
+            conditions.append("(artist LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\' "
+                              "OR creator LIKE ? ESCAPE '\\' OR version LIKE ? ESCAPE '\\')")
+            parameters.extend([f"%{self.escape_like(text)}%"] * 4)
+        for condition, value in [("max_bpm >= ?", min_bpm), ("min_bpm <= ?", max_bpm),
+                                 ("drain_length_ms >= ?", min_length_ms), ("drain_length_ms <= ?", max_length_ms)]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        query = "SELECT * FROM beatmaps"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY artist, title, version"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        return [dict(row) for row in self.connection.execute(query, parameters)]
+
+
+def parse_arguments(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="xerate-index", description="Index the maps of the osu! Songs folder and search them.")
+    parser.add_argument("--database", default=DEFAULT_INDEX_PATH, help="Path of the index database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan", help="Add new and changed maps to the index")
+    scan_parser.add_argument("songs_directory", nargs="?", default=BeatmapIndex.get_default_songs_directory(),
+                             help="The Songs folder (default: the osu! Songs folder)")
+
+    search_parser = subparsers.add_parser("search", help="Search the index")
+    search_parser.add_argument("text", nargs="?", default=None, help="Text in the artist, title, creator or version")
+    search_parser.add_argument("--min-bpm", type=float, default=None)
+    search_parser.add_argument("--max-bpm", type=float, default=None)
+    search_parser.add_argument("--min-length", type=float, default=None, help="Minimum drain length in seconds")
+    search_parser.add_argument("--max-length", type=float, default=None, help="Maximum drain length in seconds")
+    search_parser.add_argument("--limit", type=int, default=50)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    arguments = parse_arguments(argv)
+    with BeatmapIndex(arguments.database) as beatmap_index:
+        if arguments.command == "scan":
+            if not arguments.songs_directory:
+                print("Could not find the osu! Songs folder, please give its path.", file=sys.stderr)
+                return 2
+            counts = beatmap_index.scan(arguments.songs_directory)
+            print(f"{counts['read']} read, {counts['unchanged']} unchanged, {counts['removed']} removed, "
+                  f"{counts['failed']} failed.")
+            return 0
+
+        min_length_ms = arguments.min_length * 1000 if arguments.min_length is not None else None
+        max_length_ms = arguments.max_length * 1000 if arguments.max_length is not None else None
+        for beatmap in beatmap_index.search(arguments.text, arguments.min_bpm, arguments.max_bpm,
+                                            min_length_ms, max_length_ms, arguments.limit):
+            if beatmap['min_bpm'] is None:
+                bpm = "?"
+            elif beatmap['min_bpm'] == beatmap['max_bpm']:
+                bpm = f"{beatmap['min_bpm']:g}"
+            else:
+                bpm = f"{beatmap['min_bpm']:g}-{beatmap['max_bpm']:g}"
+            print(f"{beatmap['artist']} - {beatmap['title']} [{beatmap['version']}] "
+                  f"({bpm} BPM, {beatmap['drain_length_ms'] // 1000}s, {beatmap['object_count']} objects)\t"
+                  f"{beatmap['path']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
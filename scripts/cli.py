@@ -0,0 +1,301 @@
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from .audio_cache import DEFAULT_CACHE_DIRECTORY, DEFAULT_MAX_BYTES
+from .audio_processor import AudioProcessor, PYDUB_ENGINE, FFMPEG_ENGINE
+from .instrumentation import Instrumentation
+from .marathon_cache import MarathonCache, DEFAULT_MARATHON_CACHE_DIRECTORY, DEFAULT_MAX_MARATHON_CACHE_BYTES
+from .map_cache import DEFAULT_MAP_CACHE_DIRECTORY, DEFAULT_MAX_MAP_CACHE_BYTES
+from .map_generator import MapGenerator
+from .map_processor import MapProcessor
+
+SINGLE_JOB = "single"
+MARATHON_JOB = "marathon"
+
+# Exit codes
+EXIT_SUCCESS = 0
+EXIT_JOB_FAILED = 1
+EXIT_INVALID_MANIFEST = 2
+
+
+class ManifestError(ValueError):
+    # Raised when a job manifest can't be read
+    pass
+
+
+class BatchRunner:
+    # Class to run jobs from a manifest without the GUI
+    @staticmethod
+    def read_manifest(manifest_path) -> list[dict]:
+        """
+        Read the jobs of a JSON or CSV manifest
+
+        JSON manifests are a list of jobs (or {"jobs": [...]}). A single map job looks like
+        {"type": "single", "file": "map.osu", "rate": 1.2, "od": 8, "ar": 9}, with "bpm" instead of "rate"
+        to change the speed with BPM and "rates" or "bpms" for several speeds at once. A marathon job looks like
+        {"type": "marathon", "title": "...", "version": "...", "break_length": 3000, "maps": [{"file": ..., "rate": ...}]}.
+
+        CSV manifests have one map per row with the columns type, file, rate, bpm, od, ar, title, version and break_length.
+        Marathon rows with the same title are merged into one marathon, in the order of the rows.
+
+        Parameters:
+        manifest_path (str): The path of the manifest
+
+        Returns:
+        jobs (list[dict]): The jobs of the manifest
+        """
+        try:
+            with open(manifest_path, 'r', encoding='utf-8', newline='') as file:
+                if manifest_path.lower().endswith('.csv'):
+                    return BatchRunner.check_jobs(BatchRunner.read_csv_jobs(file))
+                manifest = json.load(file)
+        except (OSError, json.JSONDecodeError, csv.Error) as e:
+            raise ManifestError(f"Could not read manifest {manifest_path}: {e}")
+
+        jobs = manifest.get("jobs") if isinstance(manifest, dict) else manifest
+        if not isinstance(jobs, list):
+            raise ManifestError("The manifest must be a list of jobs or an object with a \"jobs\" list.")
+        return BatchRunner.check_jobs(jobs)
+
+    @staticmethod
+    def check_jobs(jobs) -> list[dict]:
+        """
+        Check the structure of the jobs, so a malformed manifest is rejected before any job runs.
+        The values (like the rates) are checked when the jobs run, an invalid one only fails its job.
+
+        Parameters:
+        jobs (list): The jobs of the manifest
+
+        Returns:
+        jobs (list[dict]): The same jobs
+        """
+        for job_index, job in enumerate(jobs):
+            if not isinstance(job, dict):
+                raise ManifestError(f"Job {job_index} must be an object, not {job!r}.")
+            map_jobs = job.get("maps", []) if job.get("type") == MARATHON_JOB else [job]
+            if not isinstance(map_jobs, list):
+                raise ManifestError(f"The \"maps\" of job {job_index} must be a list, not {map_jobs!r}.")
+            for map_job in map_jobs:
+                if not isinstance(map_job, dict):
+                    raise ManifestError(f"A map of job {job_index} must be an object, not {map_job!r}.")
+                for key in ("rates", "bpms"):
+                    # CSV cells hold several rates in one string
+                    if key in map_job and not isinstance(map_job[key], (list, str)):
+                        raise ManifestError(f"The \"{key}\" of job {job_index} must be a list, not {map_job[key]!r}.")
+        return jobs
+
+    @staticmethod
+    def read_csv_jobs(file) -> list[dict]:
+        jobs = []
+        marathons = {}
+        for row in csv.DictReader(file):
+            # Empty cells mean the value isn't set
+            row = {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+            job_type = row.pop("type", SINGLE_JOB)
+            if job_type == MARATHON_JOB:
+                title = row.pop("title", None)
+                if title not in marathons:
+                    marathons[title] = {"type": MARATHON_JOB, "title": title, "maps": []}
+                    jobs.append(marathons[title])
+                marathon = marathons[title]
+                for key in ("version", "break_length"):
+                    if key in row:
+                        marathon[key] = row.pop(key)
+                marathon["maps"].append(row)
+            else:
+                row["type"] = job_type
+                jobs.append(row)
+        return jobs
+
+    @staticmethod
+    def parse_number(value, name, number_type=float):
+        if value is None:
+            return None
+        try:
+            return number_type(value)
+        except (ValueError, TypeError):
+            raise ManifestError(f"Invalid {name}: {value!r}")
+
+    @staticmethod
+    def to_map_entries(map_job) -> list[tuple]:
+        """
+        Convert a map of a job to map queue entries (one per rate)
+
+        Parameters:
+        map_job (dict): The map as it is written in the manifest
+
+        Returns:
+        list[tuple]: The map queue entries
+        """
+        if "file" not in map_job:
+            raise ManifestError(f"A map has no \"file\": {map_job}")
+
+        is_map_speed_with_bpm = "bpm" in map_job or "bpms" in map_job
+        if "rates" in map_job or "bpms" in map_job:
+            rates = map_job.get("bpms") or map_job.get("rates")
+            if isinstance(rates, str):
+                # CSV cells hold several rates separated with spaces or semicolons
+                rates = rates.replace(';', ' ').split()
+        else:
+            rates = [map_job.get("bpm", map_job.get("rate", 1.0))]
+
+        od = BatchRunner.parse_number(map_job.get("od"), "od")
+        ar = BatchRunner.parse_number(map_job.get("ar"), "ar")
+        return [(BatchRunner.parse_number(rate, "rate"), is_map_speed_with_bpm, od, ar, map_job["file"])
+                for rate in rates]
+
+    @staticmethod
+    def run_marathon(map_queue, break_length, title, version, marathon_cache=None,
+                     spool_directory=None, max_workers=None) -> tuple[str, str]:
+        # Returns the path of the marathon and the error that stopped it (one of them is None)
+        try:
+            return MapGenerator.generate_marathon(map_queue, break_length, title, version,
+                                                  marathon_cache=marathon_cache,
+                                                  spool_directory=spool_directory,
+                                                  max_workers=max_workers), None
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    @staticmethod
+    def run_jobs(jobs, max_workers=None, audio_engine=PYDUB_ENGINE, marathon_cache=None,
+                 spool_directory=None) -> list[dict]:
+        """
+        Run the jobs of a manifest
+
+        Parameters:
+        jobs (list[dict]): The jobs from read_manifest()
+        max_workers (int): The number of worker processes (None uses every core, 1 runs in this process)
+        audio_engine (str): The engine that changes the audio speed of single maps (PYDUB_ENGINE or FFMPEG_ENGINE)
+        marathon_cache (MarathonCache): Keeps the prepared maps and audio segments of marathons between runs. Can be None.
+        spool_directory (str): Spool the audio of marathons to files in this folder before encoding it. Can be None.
+
+        Returns:
+        results (list[dict]): One result per generated map or marathon, with its output path and error
+        """
+        results = []
+        single_map_queue = []
+        single_map_jobs = []
+        marathons = []
+        for job_index, job in enumerate(jobs):
+            job_type = job.get("type", SINGLE_JOB)
+            try:
+                if job_type == SINGLE_JOB:
+                    for map_entry in BatchRunner.to_map_entries(job):
+                        single_map_queue.append(map_entry)
+                        single_map_jobs.append(job_index)
+                elif job_type == MARATHON_JOB:
+                    if not job.get("title"):
+                        raise ManifestError("A marathon has no \"title\".")
+                    break_length = BatchRunner.parse_number(job.get("break_length"), "break_length", int)
+                    if break_length is None:
+                        raise ManifestError("A marathon has no \"break_length\".")
+                    map_queue = [map_entry for map_job in job.get("maps", [])
+                                 for map_entry in BatchRunner.to_map_entries(map_job)]
+                    if not map_queue:
+                        raise ManifestError("A marathon has no maps.")
+                    marathons.append((job_index, map_queue, break_length, job["title"], job.get("version", "")))
+                else:
+                    raise ManifestError(f"Unknown job type: {job_type!r}")
+            except ManifestError as e:
+                results.append({"job": job_index, "type": job_type, "output": None, "error": str(e)})
+
+        if single_map_queue:
+            single_map_results = MapGenerator.generate_single_maps(
+                single_map_queue, max_workers=max_workers, audio_engine=audio_engine)
+            for job_index, map_entry, (new_file_path, error) in zip(single_map_jobs, single_map_queue,
+                                                                    single_map_results):
+                results.append({"job": job_index, "type": SINGLE_JOB, "file": map_entry[4], "rate": map_entry[0],
+                                "output": new_file_path, "error": f"{type(error).__name__}: {error}" if error else None})
+
+        if marathons:
+            if max_workers == 1 or len(marathons) == 1:
+                marathon_results = [BatchRunner.run_marathon(*marathon[1:], marathon_cache, spool_directory, max_workers)
+                                    for marathon in marathons]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers,
+                                         initializer=MapGenerator.set_worker_caches,
+                                         initargs=(AudioProcessor.audio_cache, MapProcessor.map_cache)) as executor:
+                    # Every marathon already has its own worker, so each one prepares its maps one by one
+                    futures = [executor.submit(BatchRunner.run_marathon, *marathon[1:], marathon_cache, spool_directory, 1)
+                               for marathon in marathons]
+                    marathon_results = [future.result() for future in futures]
+            for (job_index, map_queue, _, title, _), (marathon_path, error) in zip(marathons, marathon_results):
+                results.append({"job": job_index, "type": MARATHON_JOB, "title": title,
+                                "output": marathon_path, "error": error})
+
+        results.sort(key=lambda result: result["job"])
+        return results
+
+
+def parse_arguments(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="xerate", description="Change the speed of osu! maps and make marathons without the GUI.")
+    parser.add_argument("manifest", help="JSON or CSV file with the jobs to run")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of worker processes (default: every core, 1 runs everything in this process)")
+    parser.add_argument("--audio-engine", choices=[PYDUB_ENGINE, FFMPEG_ENGINE], default=PYDUB_ENGINE,
+                        help="Engine that changes the audio speed of single maps")
+    parser.add_argument("--report", default=None,
+                        help="Write the JSON results report to this file instead of stdout")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIRECTORY, help="Folder of the decoded audio cache")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // 1024 ** 2,
+                        help="Maximum size of the decoded audio cache in MB")
+    parser.add_argument("--marathon-cache-dir", default=DEFAULT_MARATHON_CACHE_DIRECTORY,
+                        help="Folder of the prepared marathon maps and audio segments, reused when a marathon is rebuilt")
+    parser.add_argument("--marathon-cache-size", type=int, default=DEFAULT_MAX_MARATHON_CACHE_BYTES // 1024 ** 2,
+                        help="Maximum size of the prepared marathon maps and audio segments in MB")
+    parser.add_argument("--map-cache-dir", default=DEFAULT_MAP_CACHE_DIRECTORY,
+                        help="Folder of the parsed maps, reused until the .osu file changes")
+    parser.add_argument("--map-cache-size", type=int, default=DEFAULT_MAX_MAP_CACHE_BYTES // 1024 ** 2,
+                        help="Maximum size of the parsed map cache in MB")
+    parser.add_argument("--spool-dir", default=None,
+                        help="Spool the audio of marathons to a file in this folder and encode it once it is complete, "
+                             "instead of streaming it into the encoder")
+    parser.add_argument("--no-cache", action="store_true", help="Don't cache decoded audio, parsed maps or marathon segments")
+    # Worker processes aren't profiled, use --workers 1 to profile every stage
+    parser.add_argument("--profile-json", default=None,
+                        help="Write the wall time, thread CPU time and peak memory growth of every stage to this JSON file")
+    parser.add_argument("--trace", default=None,
+                        help="Write the stages to this Chrome trace file (open it in chrome://tracing or Perfetto)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    arguments = parse_arguments(argv)
+    if not arguments.no_cache:
+        AudioProcessor.enable_audio_cache(arguments.cache_dir, arguments.cache_size * 1024 ** 2)
+        MapProcessor.enable_map_cache(arguments.map_cache_dir, arguments.map_cache_size * 1024 ** 2)
+    marathon_cache = None if arguments.no_cache else MarathonCache(arguments.marathon_cache_dir,
+                                                                   arguments.marathon_cache_size * 1024 ** 2)
+    if arguments.profile_json or arguments.trace:
+        Instrumentation.enable()
+
+    try:
+        jobs = BatchRunner.read_manifest(arguments.manifest)
+    except ManifestError as e:
+        print(e, file=sys.stderr)
+        return EXIT_INVALID_MANIFEST
+
+    results = BatchRunner.run_jobs(jobs, max_workers=arguments.workers, audio_engine=arguments.audio_engine,
+                                   marathon_cache=marathon_cache, spool_directory=arguments.spool_dir)
+    if arguments.profile_json:
+        Instrumentation.write_json(arguments.profile_json)
+    if arguments.trace:
+        Instrumentation.write_chrome_trace(arguments.trace)
+    failed_count = sum(1 for result in results if result["error"])
+    report = {"succeeded": len(results) - failed_count, "failed": failed_count, "results": results}
+
+    if arguments.report:
+        with open(arguments.report, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    print(f"{report['succeeded']} succeeded, {failed_count} failed.", file=sys.stderr)
+    return EXIT_JOB_FAILED if failed_count else EXIT_SUCCESS
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,13 @@ from tkinter import ttk, filedialog, messagebox, PhotoImage
 from os import environ
 from os.path import join, basename, dirname
 from .map_generator import MapGenerator
+from .map_processor import MapProcessor
+from .audio_processor import AudioProcessor, PYDUB_ENGINE, FFMPEG_ENGINE
+from .marathon_cache import MarathonCache
+from .job import JobRunner, JobCancelledError, PROGRESS_EVENT, DONE_EVENT, CANCELLED_EVENT, ERROR_EVENT
+
+# How often the GUI checks on a running job
+JOB_POLL_INTERVAL_MS = 100
 
 
 class XerateApp:
@@ -11,6 +18,10 @@ class XerateApp:
         self.root.title("Xerate")
         self.map_queue = []
         self.map_generator = MapGenerator()
+        self.job_runner = None
+        # Rebuilding a marathon after changing its queue only prepares the maps that changed.
+        # The cache stays in the temporary folder between runs, within the default budget of MarathonCache.
+        self.marathon_cache = MarathonCache()
 
         # Load icon
         try:
@@ -51,6 +62,10 @@ class XerateApp:
             self.root, text="Break length (Leave empty if you are not merging maps.)")
         self.break_length_entry = ttk.Entry(self.root)
 
+        self.workers_label = ttk.Label(
+            self.root, text="Workers (Leave empty to use every core)")
+        self.workers_entry = ttk.Entry(self.root)
+
         self.export_frame = ttk.Frame(self.root)
         self.add_to_map_queue_button = ttk.Button(
             self.export_frame, text="Add to queue", command=self.add_to_map_queue)
@@ -61,6 +76,12 @@ class XerateApp:
         self.clear_queue_button = ttk.Button(self.export_frame, text="Clear queue",
                                              command=self.clear_queue)
 
+        self.cancel_button = ttk.Button(self.export_frame, text="Cancel",
+                                        command=self.cancel_job, state=tk.DISABLED)
+
+        self.progress_label = ttk.Label(self.root, text="")
+        self.progress_bar = ttk.Progressbar(self.root, mode="determinate", length=300)
+
         self.marathon_name_label = ttk.Label(self.root, text="Marathon title")
         self.marathon_name_entry = ttk.Entry(self.root)
 
@@ -76,6 +97,14 @@ class XerateApp:
         self.change_map_speed_with_bpm = ttk.Checkbutton(
             self.root, text="Change map speed with BPM", variable=self.is_change_map_speed_with_bpm, command=self.set_mode_to_bpm)
 
+        self.is_ffmpeg_engine = tk.BooleanVar()
+        self.ffmpeg_engine_checkbox = ttk.Checkbutton(
+            self.root, text="Fast audio (single ffmpeg pass)", variable=self.is_ffmpeg_engine)
+
+        self.is_multiple_rates = tk.BooleanVar()
+        self.multiple_rates_checkbox = ttk.Checkbutton(
+            self.root, text="Multiple rates (comma separated)", variable=self.is_multiple_rates, command=self.set_mode_to_bpm)
+
         self.file_frame.pack()
         self.rate_label.pack()
         self.rate_entry.pack()
@@ -89,12 +118,19 @@ class XerateApp:
         self.marathon_version_entry.pack()
         self.break_length_label.pack()
         self.break_length_entry.pack()
+        self.workers_label.pack()
+        self.workers_entry.pack()
         self.add_to_map_queue_button.pack(side=tk.LEFT)
         self.clear_queue_button.pack(side=tk.RIGHT)
+        self.cancel_button.pack(side=tk.RIGHT)
         self.generate_button.pack(side=tk.RIGHT)
         self.export_frame.pack()
+        self.progress_label.pack()
+        self.progress_bar.pack()
         self.make_marathon_checkbox.pack()
         self.change_map_speed_with_bpm.pack()
+        self.multiple_rates_checkbox.pack()
+        self.ffmpeg_engine_checkbox.pack()
 
     def get_file_path(self):
         local_app_data = environ.get("localappdata")
@@ -135,32 +171,98 @@ class XerateApp:
                     "No marathon name", "You forgot to enter a marathon name. Please enter a marathon name.")
                 return
 
-        if is_make_marathon and len(self.map_queue) > 1:
-            try:
-                marathon_path = self.map_generator.generate_marathon(
-                    self.map_queue, break_length, marathon_title_name, marathon_version_name)
-                messagebox.showinfo("Map merging complete!", f"Map merging completed successfully! "
-                                    f"Your map is located in {marathon_path}. "
-                                    f"Press F5 in osu! to play the map.")
+        try:
+            workers = int(self.workers_entry.get())
+        except (ValueError, TypeError):
+            workers = None
 
-            except Exception as e:
-                messagebox.showerror(
-                    "Could not generate marathon.", f"Marathon generation error: {e}.")
+        # The queue is copied so it can't change while the job runs
+        self.job_map_queue = list(self.map_queue)
+        if is_make_marathon and len(self.map_queue) > 1:
+            self.start_job(self.map_generator.generate_marathon, self.on_marathon_done, self.on_marathon_error,
+                           self.job_map_queue, break_length, marathon_title_name, marathon_version_name,
+                           marathon_cache=self.marathon_cache, max_workers=workers)
         else:
-            for rate, is_map_speed_with_bpm, overall_difficulty, approach_rate, file_path in self.map_queue:
-                new_file_path, new_file_contents = self.map_generator.generate_single_map(
-                    rate, is_map_speed_with_bpm, overall_difficulty, approach_rate, file_path)
-                try:
-                    self.map_generator.export_new_file(
-                        new_file_path, new_file_contents)
-                except Exception as e:
-                    messagebox.showerror(
-                        "File exporting error!", f"File exporting error: {e}")
-                    return
+            audio_engine = FFMPEG_ENGINE if self.is_ffmpeg_engine.get() else PYDUB_ENGINE
+            self.start_job(self.map_generator.generate_single_maps, self.on_single_maps_done, self.on_single_maps_error,
+                           self.job_map_queue, max_workers=workers, audio_engine=audio_engine)
+
+    def start_job(self, job, on_done, on_error, *args, **kwargs):
+        # Run the job on a worker thread so the window stays responsive
+        self.job_runner = JobRunner(job, *args, **kwargs)
+        self.job_on_done = on_done
+        self.job_on_error = on_error
+        self.generate_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.progress_label.config(text="Starting...")
+        self.progress_bar.config(value=0, maximum=1)
+        self.job_runner.start()
+        self.root.after(JOB_POLL_INTERVAL_MS, self.poll_job)
+
+    def poll_job(self):
+        for event_type, value in self.job_runner.poll():
+            if event_type == PROGRESS_EVENT:
+                stage, current, total = value
+                self.progress_label.config(text=f"{stage} ({current}/{total})")
+                self.progress_bar.config(value=current, maximum=max(total, 1))
+            else:
+                self.finish_job()
+                if event_type == DONE_EVENT:
+                    self.job_on_done(value)
+                elif event_type == CANCELLED_EVENT:
+                    messagebox.showinfo("Generation cancelled", "The generation was cancelled.")
+                elif event_type == ERROR_EVENT:
+                    self.job_on_error(value)
+                return
+        self.root.after(JOB_POLL_INTERVAL_MS, self.poll_job)
+
+    def finish_job(self):
+        self.job_runner = None
+        self.generate_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.progress_label.config(text="")
+        self.progress_bar.config(value=0)
+
+    def cancel_job(self):
+        if self.job_runner is not None:
+            self.job_runner.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.progress_label.config(text="Cancelling...")
+
+    def on_marathon_done(self, marathon_path):
+        messagebox.showinfo("Map merging complete!", f"Map merging completed successfully! "
+                            f"Your map is located in {marathon_path}. "
+                            f"Press F5 in osu! to play the map.")
+        self.clear_after_generation()
+
+    def on_marathon_error(self, error):
+        messagebox.showerror(
+            "Could not generate marathon.", f"Marathon generation error: {error}.")
+        self.clear_after_generation()
+
+    def on_single_maps_done(self, results):
+        if any(isinstance(error, JobCancelledError) for _, error in results):
+            exported_count = sum(1 for new_file_path, _ in results if new_file_path)
+            messagebox.showinfo("Generation cancelled",
+                                f"The generation was cancelled after exporting {exported_count} maps.")
+            return
 
-            messagebox.showinfo("Map generation complete!",
-                                "Map generation completed successfully! Press F5 in osu! to play the map.")
+        errors = [f"{basename(file_path)} ({rate}): {error}"
+                  for (rate, _, _, _, file_path), (_, error) in zip(self.job_map_queue, results) if error]
+        if errors:
+            messagebox.showerror(
+                "File exporting error!", "File exporting error:\n" + "\n".join(errors))
+            return
 
+        messagebox.showinfo("Map generation complete!",
+                            "Map generation completed successfully! Press F5 in osu! to play the map.")
+        self.clear_after_generation()
+
+    def on_single_maps_error(self, error):
+        messagebox.showerror(
+            "File exporting error!", f"File exporting error: {error}")
+
+    def clear_after_generation(self):
         self.clear_selected_files()
         self.clear_queue()
         self.clear_entries()
@@ -175,10 +277,7 @@ class XerateApp:
         if hasattr(self.file_label, "file_paths"):
             file_path = self.file_label.file_paths
             if file_path:
-                try:
-                    rate = float(self.rate_entry.get())
-                except (ValueError, TypeError):
-                    rate = 1.0
+                rates = self.get_rates()
                 try:
                     overall_difficulty = float(
                         self.overall_difficulty_entry.get())
@@ -189,8 +288,9 @@ class XerateApp:
                 except (ValueError, TypeError):
                     approach_rate = None
                 change_map_speed_with_bpm = self.is_change_map_speed_with_bpm.get() == 1
-                self.map_queue.append(
-                    (rate, change_map_speed_with_bpm, overall_difficulty, approach_rate, file_path))
+                for rate in rates:
+                    self.map_queue.append(
+                        (rate, change_map_speed_with_bpm, overall_difficulty, approach_rate, file_path))
                 self.file_label.config(
                     text=f"No files selected,{len(self.map_queue)} files in queue")
                 self.clear_entries()
@@ -201,13 +301,37 @@ class XerateApp:
             messagebox.showerror("No files selected",
                                  "You haven't selected any files.")
 
+    def get_rates(self):
+        # In multiple rates mode the entry holds a comma separated list of rates
+        if self.is_multiple_rates.get():
+            rate_entries = self.rate_entry.get().split(',')
+        else:
+            rate_entries = [self.rate_entry.get()]
+
+        rates = []
+        for rate_entry in rate_entries:
+            try:
+                rates.append(float(rate_entry))
+            except (ValueError, TypeError):
+                rates.append(1.0)
+        return rates
+
     def set_mode_to_bpm(self):
         if self.is_change_map_speed_with_bpm.get():
-            self.rate_label.config(text="BPM (integer):")
+            rate_text = "BPM"
+            value_text = "integer"
+        else:
+            rate_text = "Rate"
+            value_text = "floating point value"
+
+        if self.is_multiple_rates.get():
+            self.rate_label.config(text=f"{rate_text}s (comma separated {value_text}s):")
         else:
-            self.rate_label.config(text="Rate (floating point value):")
+            self.rate_label.config(text=f"{rate_text} ({value_text}):")
 
     def on_close(self):
+        if self.job_runner is not None:
+            self.job_runner.cancel()
         self.root.quit()
 
     def clear_queue(self):
@@ -229,6 +353,8 @@ class XerateApp:
 
 
 def main():
+    AudioProcessor.enable_audio_cache()
+    MapProcessor.enable_map_cache()
     root = tk.Tk()
     image_path = join(dirname(__file__), "Xerate.png")
     app = XerateApp(root, image_path)
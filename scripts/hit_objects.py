@@ -0,0 +1,237 @@
+import numpy as np
+
+# In osu!, the 2nd bit of the type marks a slider, the 4th bit a spinner and the 8th bit a hold note
+SLIDER = 2
+SPINNER = 8
+HOLD_NOTE = 128
+# The SliderMultiplier of maps whose Difficulty section doesn't have one
+DEFAULT_SLIDER_MULTIPLIER = 1.4
+
+
+class HitObjectsTable:
+    # Class to hold a HitObjects section as columns so timings can be changed in bulk
+    def __init__(self, positions, start_times, types, end_times, middles, tails, other_lines) -> None:
+        """
+        Create a HitObjects table from its columns. Use from_section() to parse one from an .osu file.
+
+        Parameters:
+        positions (list[str]): The "x,y" part of every hit object
+        start_times (np.ndarray): The start time of every hit object
+        types (np.ndarray): The type of every hit object
+        end_times (np.ndarray): The end time of hold notes and spinners (0 for other objects)
+        middles (list[str]): The raw text between the type and the end time
+        tails (list[str]): The raw text after the end time
+        other_lines (list[tuple]): Lines that are not hit objects as (row, line), row being the object they come before
+        """
+        self.positions = positions
+        self.start_times = start_times
+        self.types = types
+        self.end_times = end_times
+        self.middles = middles
+        self.tails = tails
+        self.other_lines = other_lines
+
+    def __len__(self) -> int:
+        return len(self.start_times)
+
+    @property
+    def has_end_time(self) -> np.ndarray:
+        # Hold notes and spinners are the only objects with an end time
+        return (self.types & (HOLD_NOTE | SPINNER)) != 0
+
+    @property
+    def is_slider(self) -> np.ndarray:
+        return (self.types & SLIDER) != 0
+
+    @staticmethod
+    def get_slider_durations(start_times, slides, lengths, timing_index,
+                             slider_multiplier=DEFAULT_SLIDER_MULTIPLIER) -> np.ndarray:
+        """
+        Get the duration of sliders from the timing points active at their start
+
+        Parameters:
+        start_times (np.ndarray): The start time of every slider
+        slides (np.ndarray): How many times every slider is travelled (1 + its repeats)
+        lengths (np.ndarray): The length of every slider in osu! pixels
+        timing_index (TimingIndex): The timing points of the map
+        slider_multiplier (float): The SliderMultiplier of the map (osu! pixels per beat / 100)
+
+        Returns:
+        np.ndarray: The duration of every slider in milliseconds
+        """
+        beat_lengths = timing_index.get_beat_lengths_at(start_times)
+        slider_velocities = timing_index.get_slider_velocities_at(start_times)
+        return lengths * slides / (slider_multiplier * 100 * slider_velocities) * beat_lengths
+
+    def get_end_times(self, timing_index, slider_multiplier=DEFAULT_SLIDER_MULTIPLIER) -> np.ndarray:
+        """
+        Get the time every hit object ends at. Slider ends are computed for all sliders at once.
+
+        Parameters:
+        timing_index (TimingIndex): The timing points of the map
+        slider_multiplier (float): The SliderMultiplier of the map
+
+        Returns:
+        np.ndarray: The end time of every hit object (the start time of circles)
+        """
+        end_times = np.where(self.has_end_time, self.end_times, self.start_times).astype(np.float64)
+        slider_rows = np.flatnonzero(self.is_slider)
+        # Without an uninherited timing point a slider has no duration
+        if not len(slider_rows) or not len(timing_index.uninherited_times):
+            return end_times
+
+        # The middle of a slider is ",hitSound,curve,slides,length[,edgeSounds,edgeSets]"
+        slider_columns = [self.middles[row].split(',', 5) for row in slider_rows.tolist()]
+        # A slider line cut before its length has no duration
+        is_complete = np.array([len(columns) > 4 for columns in slider_columns], dtype=bool)
+        slider_rows = slider_rows[is_complete]
+        slider_columns = [columns for columns in slider_columns if len(columns) > 4]
+        slides = np.array([float(columns[3]) for columns in slider_columns])
+        lengths = np.array([float(columns[4]) for columns in slider_columns])
+        start_times = self.start_times[slider_rows]
+        end_times[slider_rows] = start_times + HitObjectsTable.get_slider_durations(
+            start_times, slides, lengths, timing_index, slider_multiplier)
+        return end_times
+
+    @staticmethod
+    def from_section(hitobjects_section) -> "HitObjectsTable":
+        """
+        Parse a HitObjects section into a table
+
+        Parameters:
+        hitobjects_section (list): The HitObjects section from the .osu file
+
+        Returns:
+        table (HitObjectsTable): The parsed HitObjects
+        """
+        positions = []
+        start_times = []
+        types = []
+        end_times = []
+        middles = []
+        tails = []
+        other_lines = []
+        for line in hitobjects_section:
+            line_elements = line.strip().split(',')
+            if len(line_elements) < 4:
+                # Headers, empty lines and comments are kept as they are
+                other_lines.append((len(start_times), line))
+                continue
+
+            type_of_object = int(line_elements[3])
+            positions.append(f"{line_elements[0]},{line_elements[1]}")
+            start_times.append(int(line_elements[2]))
+            types.append(type_of_object)
+
+            extras = ',' + ','.join(line_elements[6:]) if len(line_elements) > 6 else ''
+            # Hold notes keep their end time in front of the hit sample (endTime:hitSample)
+            if type_of_object & HOLD_NOTE:
+                end_time, separator, hit_sample = line_elements[5].partition(':')
+                end_times.append(int(end_time))
+                middles.append(f",{line_elements[4]},")
+                tails.append(separator + hit_sample + extras)
+            elif type_of_object & SPINNER:
+                end_times.append(int(line_elements[5]))
+                middles.append(f",{line_elements[4]},")
+                tails.append(extras)
+            else:
+                end_times.append(0)
+                middles.append(',' + ','.join(line_elements[4:]) if len(line_elements) > 4 else '')
+                tails.append('')
+
+        return HitObjectsTable(positions,
+                               np.array(start_times, dtype=np.int64),
+                               np.array(types, dtype=np.int64),
+                               np.array(end_times, dtype=np.int64),
+                               middles,
+                               tails,
+                               other_lines)
+
+    def to_section(self, keep_other_lines=True) -> list[str]:
+        """
+        Convert the table back to a HitObjects section
+
+        Parameters:
+        keep_other_lines (bool): Whether to write the lines that are not hit objects (header, empty lines)
+
+        Returns:
+        hitobjects_section (list): The HitObjects section as a list of lines
+        """
+        end_times = np.where(self.has_end_time, self.end_times.astype(str), '').tolist()
+        lines = [f"{position},{start_time},{type_of_object}{middle}{end_time}{tail}\n"
+                 for position, start_time, type_of_object, middle, end_time, tail
+                 in zip(self.positions, self.start_times.tolist(), self.types.tolist(),
+                        self.middles, end_times, self.tails)]
+        if not keep_other_lines or not self.other_lines:
+            return lines
+
+        # Put the other lines back in front of the object they came before
+        hitobjects_section = []
+        previous_row = 0
+        for row, line in self.other_lines:
+            hitobjects_section.extend(lines[previous_row:row])
+            hitobjects_section.append(line)
+            previous_row = row
+        hitobjects_section.extend(lines[previous_row:])
+        return hitobjects_section
+
+    def with_times(self, start_times, end_times) -> "HitObjectsTable":
+        # Text columns are never modified so they can be shared with the new table
+        return HitObjectsTable(self.positions, start_times, self.types, end_times,
+                               self.middles, self.tails, self.other_lines)
+
+    def change_speed(self, rate) -> "HitObjectsTable":
+        """
+        Divide the timing info of every hit object by the rate
+
+        Parameters:
+        rate (float): The rate to update the HitObjects' timing info
+
+        Returns:
+        table (HitObjectsTable): A new table with the updated timing info
+        """
+        return self.with_times(np.floor(self.start_times / rate).astype(np.int64),
+                               np.floor(self.end_times / rate).astype(np.int64))
+
+    def shift(self, offset) -> "HitObjectsTable":
+        """
+        Add an offset to the timing info of every hit object
+
+        Parameters:
+        offset (float): The offset in milliseconds
+
+        Returns:
+        table (HitObjectsTable): A new table with the shifted timing info
+        """
+        return self.with_times(np.floor(self.start_times + offset).astype(np.int64),
+                               np.floor(self.end_times + offset).astype(np.int64))
+
+    @staticmethod
+    def concatenate(tables) -> "HitObjectsTable":
+        """
+        Concatenate the hit objects of several tables. Lines that are not hit objects are dropped.
+
+        Parameters:
+        tables (list[HitObjectsTable]): The tables to concatenate
+
+        Returns:
+        table (HitObjectsTable): The concatenated table
+        """
+        positions = []
+        middles = []
+        tails = []
+        for table in tables:
+            positions.extend(table.positions)
+            middles.extend(table.middles)
+            tails.extend(table.tails)
+
+        def concatenate_column(name):
+            return np.concatenate([getattr(table, name) for table in tables]) if tables else np.array([], dtype=np.int64)
+
+        return HitObjectsTable(positions,
+                               concatenate_column("start_times"),
+                               concatenate_column("types"),
+                               concatenate_column("end_times"),
+                               middles,
+                               tails,
+                               [])
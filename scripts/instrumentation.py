@@ -0,0 +1,162 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Peak RSS comes from resource on Unix and from psutil (if installed) elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class Instrumentation:
+    # Class to record the wall time, CPU time and memory of each stage of a job. Disabled until enable() is called.
+    # The CPU time is the one of the thread that ran the stage, without other threads or child processes like ffmpeg.
+    # The peak RSS is the high-water mark of the whole process, a stage only owns how much it raised it
+    # (which also counts what other threads allocated at the same time).
+    records = None
+    origin = 0.0
+
+    @staticmethod
+    def enable() -> None:
+        # Start recording, dropping what was recorded before
+        Instrumentation.records = []
+        Instrumentation.origin = time.perf_counter()
+
+    @staticmethod
+    def disable() -> None:
+        Instrumentation.records = None
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return Instrumentation.records is not None
+
+    @staticmethod
+    def get_peak_rss() -> int or None:
+        """
+        Get the highest resident memory the process has used so far
+
+        Returns:
+        int: The peak RSS in bytes (None if it can't be measured on this platform)
+        """
+        if resource is not None:
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports kilobytes, macOS reports bytes
+            return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+        if psutil is not None:
+            memory_info = psutil.Process().memory_info()
+            return getattr(memory_info, "peak_wset", memory_info.rss)
+        return None
+
+    @staticmethod
+    @contextmanager
+    def stage(name, **args):
+        """
+        Record a stage of a job. Does nothing when instrumentation is disabled.
+        The record has the wall time, the CPU time of the thread (thread_cpu_seconds), the peak RSS of the process
+        when the stage ended (process_peak_rss_bytes) and how much the stage raised it (peak_rss_growth_bytes).
+
+        Parameters:
+        name (str): The name of the stage
+        args: Extra information about the stage, like the map it works on
+
+        Usage:
+        with Instrumentation.stage("decode", file=file_path):
+            audio = AudioSegment.from_file(file_path)
+        """
+        if Instrumentation.records is None:
+            yield
+            return
+
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.thread_time()
+        start_peak_rss = Instrumentation.get_peak_rss()
+        try:
+            yield
+        finally:
+            end_wall_time = time.perf_counter()
+            end_peak_rss = Instrumentation.get_peak_rss()
+            # A stage that started before enable() was called again is dropped with the old records
+            if Instrumentation.records is not None:
+                Instrumentation.records.append({
+                    "name": name,
+                    "start_seconds": start_wall_time - Instrumentation.origin,
+                    "wall_seconds": end_wall_time - start_wall_time,
+                    "thread_cpu_seconds": time.thread_time() - start_cpu_time,
+                    "process_peak_rss_bytes": end_peak_rss,
+                    "peak_rss_growth_bytes": end_peak_rss - start_peak_rss if end_peak_rss is not None else None,
+                    "thread": threading.get_ident(),
+                    "args": args,
+                })
+
+    @staticmethod
+    def timed(name):
+        """
+        Decorator to record every call of a function as a stage
+
+        Parameters:
+        name (str): The name of the stage
+
+        Usage:
+        @staticmethod
+        @Instrumentation.timed("load_audio")
+        def load_audio(audio_file_path):
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with Instrumentation.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def get_records() -> list[dict]:
+        # The records are sorted by start time, so parent stages come before the stages inside them
+        return sorted(Instrumentation.records or [], key=lambda record: record["start_seconds"])
+
+    @staticmethod
+    def write_json(file_path) -> None:
+        """
+        Write the recorded stages as JSON
+
+        Parameters:
+        file_path (str): The path of the JSON file
+        """
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump({"stages": Instrumentation.get_records()}, file, indent=2, default=str)
+
+    @staticmethod
+    def write_chrome_trace(file_path) -> None:
+        """
+        Write the recorded stages in the Chrome trace event format (chrome://tracing, Perfetto)
+
+        Parameters:
+        file_path (str): The path of the trace file
+        """
+        process_id = os.getpid()
+        trace_events = []
+        for record in Instrumentation.get_records():
+            trace_events.append({
+                "name": record["name"],
+                "cat": "xerate",
+                "ph": "X",
+                "ts": record["start_seconds"] * 1e6,
+                "dur": record["wall_seconds"] * 1e6,
+                "pid": process_id,
+                "tid": record["thread"],
+                "args": {**record["args"],
+                         "thread_cpu_seconds": record["thread_cpu_seconds"],
+                         "process_peak_rss_bytes": record["process_peak_rss_bytes"],
+                         "peak_rss_growth_bytes": record["peak_rss_growth_bytes"]},
+            })
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file, default=str)
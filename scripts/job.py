@@ -0,0 +1,102 @@
+import queue
+import threading
+
+# Events sent from a job to whoever polls it
+PROGRESS_EVENT = "progress"
+DONE_EVENT = "done"
+ERROR_EVENT = "error"
+CANCELLED_EVENT = "cancelled"
+
+
+class JobCancelledError(Exception):
+    # Raised inside a job when it notices it has been cancelled
+    pass
+
+
+class CancellationToken:
+    # Class to ask a running job to stop at the next stage
+    def __init__(self) -> None:
+        self.event = threading.Event()
+
+    def cancel(self) -> None:
+        self.event.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.is_cancelled:
+            raise JobCancelledError("The job was cancelled.")
+
+
+def check_cancelled(cancellation_token) -> None:
+    # Jobs accept None when they can't be cancelled
+    if cancellation_token is not None:
+        cancellation_token.raise_if_cancelled()
+
+
+def report_progress(progress, stage, current, total) -> None:
+    """
+    Report the progress of a job if it has a progress callback
+
+    Parameters:
+    progress (callable): The callback, called as progress(stage, current, total). Can be None.
+    stage (str): What the job is doing
+    current (int): How many steps of the stage are done
+    total (int): The number of steps of the stage
+    """
+    if progress is not None:
+        progress(stage, current, total)
+
+
+class JobRunner:
+    # Class to run a job on a worker thread and collect its progress and result with poll()
+    def __init__(self, job, *args, **kwargs) -> None:
+        """
+        Parameters:
+        job (callable): The job. It is called with the arguments plus the progress and cancellation_token keywords.
+        """
+        self.job = job
+        self.args = args
+        self.kwargs = kwargs
+        self.cancellation_token = CancellationToken()
+        self.events = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def cancel(self) -> None:
+        self.cancellation_token.cancel()
+
+    @property
+    def is_running(self) -> bool:
+        return self.thread.is_alive()
+
+    def run(self) -> None:
+        try:
+            result = self.job(*self.args, progress=self.on_progress,
+                              cancellation_token=self.cancellation_token, **self.kwargs)
+            self.events.put((DONE_EVENT, result))
+        except JobCancelledError as e:
+            self.events.put((CANCELLED_EVENT, e))
+        except Exception as e:
+            self.events.put((ERROR_EVENT, e))
+
+    def on_progress(self, stage, current, total) -> None:
+        self.events.put((PROGRESS_EVENT, (stage, current, total)))
+
+    def poll(self) -> list[tuple]:
+        """
+        Get the events the job sent since the last poll, without blocking
+
+        Returns:
+        list[tuple]: The events as (event type, value)
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
@@ -0,0 +1,95 @@
+import re
+
+# The sections of an .osu file made of "Key: Value" lines
+KEY_VALUE_SECTIONS = ("General", "Editor", "Metadata", "Difficulty")
+
+# Splits a line into the key, the separator (the colon and the spaces around it, kept as written), the value and the line ending
+KEY_VALUE_PATTERN = re.compile(r"([^:]+?)([ \t]*:[ \t]*)(.*?)(\s*)$", re.DOTALL)
+
+
+class KeyValueSection:
+    # Class to hold a key/value section with an index of its keys, so variables are found and changed without scanning
+    def __init__(self, lines) -> None:
+        """
+        Parameters:
+        lines (list[str]): The lines of the section, the header included
+        """
+        self.lines = list(lines)
+        self.index = {}
+        for row, line in enumerate(self.lines):
+            match = KEY_VALUE_PATTERN.match(line)
+            # The header, comments and empty lines aren't variables
+            if match and not line.startswith(('[', '//')):
+                # osu! uses the first value of a key that appears twice
+                self.index.setdefault(match.group(1).strip(), row)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __getitem__(self, item):
+        return self.lines[item]
+
+    def __contains__(self, key) -> bool:
+        return key in self.index
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, KeyValueSection):
+            return self.lines == other.lines
+        return self.lines == other
+
+    def __repr__(self) -> str:
+        return f"KeyValueSection({self.lines!r})"
+
+    def copy(self) -> "KeyValueSection":
+        # The lines are strings, so copying the list and the index is enough
+        section = KeyValueSection.__new__(KeyValueSection)
+        section.lines = self.lines.copy()
+        section.index = self.index.copy()
+        return section
+
+    def get(self, key, default=None) -> str or None:
+        """
+        Get the value of a key
+
+        Parameters:
+        key (str): The key, matched exactly ("Title" doesn't match "TitleUnicode")
+        default: The value to return when the section doesn't have the key
+
+        Returns:
+        str: The value without the spaces around it
+        """
+        row = self.index.get(key)
+        if row is None:
+            return default
+        return KEY_VALUE_PATTERN.match(self.lines[row]).group(3)
+
+    def set(self, key, value) -> None:
+        """
+        Change the value of a key in place, keeping the separator of its line.
+        Keys the section doesn't have are added after its last variable.
+
+        Parameters:
+        key (str): The key
+        value (str): The new value
+        """
+        row = self.index.get(key)
+        if row is not None:
+            match = KEY_VALUE_PATTERN.match(self.lines[row])
+            self.lines[row] = f"{match.group(1)}{match.group(2)}{value}\n"
+            return
+
+        # New keys go after the last variable, before the empty lines that end the section
+        row = max(self.index.values()) + 1 if self.index else min(len(self.lines), 1)
+        self.lines.insert(row, f"{key}: {value}\n")
+        for other_key, other_row in self.index.items():
+            if other_row >= row:
+                self.index[other_key] = other_row + 1
+        self.index[key] = row
+
+    @staticmethod
+    def from_section(section) -> "KeyValueSection":
+        # Sections that are already indexed are used as they are
+        return section if isinstance(section, KeyValueSection) else KeyValueSection(section)
@@ -0,0 +1,201 @@
+import hashlib
+import marshal
+import os
+import struct
+import tempfile
+from os.path import join, getsize
+import numpy as np
+from .hit_objects import HitObjectsTable, DEFAULT_SLIDER_MULTIPLIER
+from .key_value_section import KeyValueSection, KEY_VALUE_SECTIONS
+from .timing_index import TimingIndex, TIMING_POINT_TYPE
+
+# Magic, format version, modification time and size of the source file
+HEADER = struct.Struct('<4sIqq')
+MAGIC = b'XMAP'
+FORMAT_VERSION = 2
+CACHE_EXTENSION = '.map'
+DEFAULT_MAP_CACHE_DIRECTORY = join(tempfile.gettempdir(), "Xerate", "map_cache")
+DEFAULT_MAX_MAP_CACHE_BYTES = 256 * 1024 ** 2
+# A full cache is trimmed below its budget, so the next puts don't list the folder again right away
+EVICTED_SIZE_RATIO = 0.9
+
+
+class ParsedMap:
+    # Class to hold everything that is parsed from an .osu file before its rate is changed
+    def __init__(self, sections, timing_points, first_object_time, last_object_time) -> None:
+        """
+        Parameters:
+        sections (dict): The sections of the file, like read_osu_sections() returns them
+        timing_points (np.ndarray): The time, beat length and uninherited flag of every timing point (TIMING_POINT_TYPE)
+        first_object_time (int): The time of the first hit object (None if the map has none)
+        last_object_time (float): The time the last hit object to end ends at, sliders included (None if the map has none)
+        """
+        self.sections = sections
+        self.timing_points = timing_points
+        self.timing_index = TimingIndex(timing_points)
+        self.first_object_time = first_object_time
+        self.last_object_time = last_object_time
+
+    @staticmethod
+    def from_sections(sections) -> "ParsedMap":
+        timing_points = TimingIndex.parse_section(sections.get("TimingPoints", []))
+
+        first_object_time = last_object_time = None
+        hit_objects = HitObjectsTable.from_section(sections.get("HitObjects", []))
+        if len(hit_objects):
+            first_object_time = int(hit_objects.start_times[0])
+            # Sliders, hold notes and spinners end after they start, and a long one can end after the last object
+            slider_multiplier = float(KeyValueSection.from_section(sections.get("Difficulty", [])).get(
+                "SliderMultiplier", DEFAULT_SLIDER_MULTIPLIER))
+            last_object_time = float(hit_objects.get_end_times(TimingIndex(timing_points), slider_multiplier).max())
+        return ParsedMap(sections, timing_points, first_object_time, last_object_time)
+
+    def get_drain_length(self) -> float:
+        """
+        Get the time between the start of the first object and the end of the last one, without the breaks
+
+        Returns:
+        float: The drain length in milliseconds (0 if the map has no objects)
+        """
+        if self.first_object_time is None:
+            return 0
+        drain_length = self.last_object_time - self.first_object_time
+        for line in self.sections.get("Events", []):
+            line_elements = line.strip().split(',')
+            if line_elements[0] in ["2", "Break"] and len(line_elements) >= 3:
+                drain_length -= int(line_elements[2]) - int(line_elements[1])
+        return max(drain_length, 0)
+
+    def to_bytes(self, mtime_ns, size) -> bytes:
+        # marshal only handles built in types, so the sections are stored as plain lists of lines
+        payload = marshal.dumps((
+            [(name, list(lines)) for name, lines in self.sections.items()],
+            self.timing_points.tobytes(),
+            self.first_object_time,
+            self.last_object_time,
+        ))
+        return HEADER.pack(MAGIC, FORMAT_VERSION, mtime_ns, size) + payload
+
+    @staticmethod
+    def from_bytes(data) -> "ParsedMap":
+        section_items, timing_points, first_object_time, last_object_time = marshal.loads(data[HEADER.size:])
+        sections = {name: KeyValueSection(lines) if name in KEY_VALUE_SECTIONS else lines
+                    for name, lines in section_items}
+        return ParsedMap(sections, np.frombuffer(timing_points, dtype=TIMING_POINT_TYPE).copy(),
+                         first_object_time, last_object_time)
+
+
+class MapCache:
+    # Class to keep parsed maps on disk, so reading the same .osu file again is a single small file read
+    def __init__(self, cache_directory=DEFAULT_MAP_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_MAP_CACHE_BYTES) -> None:
+        """
+        Parameters:
+        cache_directory (str): The folder to store the parsed maps in
+        max_bytes (int): The maximum size of the cache. The least recently used entries are removed past it.
+        """
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+        # The size of the folder is counted on the first put and then kept up to date,
+        # so storing one of thousands of maps doesn't list the whole folder
+        self.stored_bytes = None
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+    def get_path(self, file_path) -> str:
+        # One entry per map, the modification time and size in its header tell if it is still valid
+        key = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return join(self.cache_directory, key + CACHE_EXTENSION)
+
+    def get(self, file_path) -> ParsedMap or None:
+        """
+        Get a parsed map if its .osu file hasn't changed since it was stored
+
+        Parameters:
+        file_path (str): The path of the .osu file
+
+        Returns:
+        ParsedMap: The parsed map (None if it isn't cached or the file changed)
+        """
+        file_stat = os.stat(file_path)
+        cache_path = self.get_path(file_path)
+        try:
+            with open(cache_path, 'rb') as file:
+                data = file.read()
+            magic, format_version, mtime_ns, size = HEADER.unpack_from(data)
+            if (magic, format_version, mtime_ns, size) != (MAGIC, FORMAT_VERSION,
+                                                          file_stat.st_mtime_ns, file_stat.st_size):
+                return None
+            parsed_map = ParsedMap.from_bytes(data)
+            # Mark the entry as recently used
+            os.utime(cache_path)
+            return parsed_map
+        except (FileNotFoundError, struct.error, EOFError, ValueError, TypeError):
+            return None
+
+    def put(self, file_path, parsed_map) -> None:
+        """
+        Store a parsed map and evict the least recently used entries if the cache is full
+
+        Parameters:
+        file_path (str): The path of the .osu file it was parsed from
+        parsed_map (ParsedMap): The parsed map
+        """
+        file_stat = os.stat(file_path)
+        data = parsed_map.to_bytes(file_stat.st_mtime_ns, file_stat.st_size)
+        if len(data) > self.max_bytes:
+            return
+
+        # Write to a temporary file first so other processes never read a half written entry
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temporary_path, self.get_path(file_path))
+        except Exception:
+            os.remove(temporary_path)
+            raise
+
+        # A replaced entry is counted twice until the next eviction counts the folder again
+        if self.stored_bytes is None:
+            self.stored_bytes = self.get_stored_bytes()
+        else:
+            self.stored_bytes += len(data)
+        if self.stored_bytes > self.max_bytes:
+            self.evict()
+
+    def get_entries(self) -> list[tuple[float, int, str]]:
+        # The last use, size and path of every entry
+        entries = []
+        for file_name in os.listdir(self.cache_directory):
+            if file_name.endswith(CACHE_EXTENSION):
+                cache_path = join(self.cache_directory, file_name)
+                try:
+                    entries.append((os.path.getmtime(cache_path), getsize(cache_path), cache_path))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    def get_stored_bytes(self) -> int:
+        return sum(size for _, size, _ in self.get_entries())
+
+    def evict(self) -> None:
+        # Remove the least recently used entries until the cache fits in its budget
+        entries = self.get_entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        if total_bytes <= self.max_bytes:
+            self.stored_bytes = total_bytes
+            return
+        for _, size, cache_path in sorted(entries):
+            if total_bytes <= self.max_bytes * EVICTED_SIZE_RATIO:
+                break
+            try:
+                os.remove(cache_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+        self.stored_bytes = total_bytes
+
+    def clear(self) -> None:
+        for file_name in os.listdir(self.cache_directory):
+            if file_name.endswith(CACHE_EXTENSION):
+                os.remove(join(self.cache_directory, file_name))
+        self.stored_bytes = 0
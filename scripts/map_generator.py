@@ -1,14 +1,30 @@
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import chain
+from typing import Iterator
 from os.path import join, dirname, basename
-from .audio_processor import AudioProcessor
+from .audio_processor import AudioProcessor, PYDUB_ENGINE
+from .instrumentation import Instrumentation
+from .key_value_section import KeyValueSection
+from .job import JobCancelledError, check_cancelled, report_progress
+from .map_cache import ParsedMap
 from .map_processor import MapProcessor
 
 
+# Preparing a marathon map parses about 10 MB of .osu files per second, while starting the worker processes
+# costs 0.2 s or more (more on Windows, where every worker imports the package again). Smaller queues are prepared
+# in this process, where the pool would only add its start up time.
+PARALLEL_MAP_BYTES = 16 * 1024 * 1024
+
+
 class MapGenerator:
     # Class to generate maps.
 
     @staticmethod
-    def generate_marathon(map_queue, break_length, marathon_title_name, marathon_version_name) -> str:
+    @Instrumentation.timed("generate_marathon")
+    def generate_marathon(map_queue, break_length, marathon_title_name, marathon_version_name,
+                          progress=None, cancellation_token=None, marathon_cache=None, spool_directory=None,
+                          max_workers=None) -> str:
         """
         Generate a marathon from a list of maps.
 
@@ -17,27 +33,37 @@ class MapGenerator:
         break_length (int): The length of the break in milliseconds.
         marathon_title_name (str): The name of the marathon.
         marathon_version_name (str): The version of the marathon (difficulty name).
+        progress (callable): Called as progress(stage, current, total) as the marathon is generated.
+        cancellation_token (CancellationToken): Stops the generation between stages with JobCancelledError once cancelled.
+        marathon_cache (MarathonCache): Keeps the prepared maps and audio segments, so a rebuild only prepares the maps that changed.
+        spool_directory (str): Spool the audio to a file in this folder before encoding it (None streams it into the encoder).
+        max_workers (int): The number of maps prepared at once (None uses every core, 1 prepares them one by one).
 
         Returns:
         str: The path to the generated marathon.
         """
-        first_maps_sections = MapProcessor.read_osu_sections(
-            map_queue[0][4])
-        sections = MapGenerator.handle_map_queue(map_queue)
-        merged_sections = MapProcessor.merge_maps(first_maps_sections,
-                                                  sections["hitobjects"],
-                                                  sections["timing_points"],
-                                                  sections["events"],
-                                                  sections["bookmarks"],
-                                                  break_length,
-                                                  sections["first_and_last_objects"])
-
+        with Instrumentation.stage("read_map", file=map_queue[0][4]):
+            first_maps_sections = MapProcessor.read_osu_sections(
+                map_queue[0][4])
+        sections = MapGenerator.handle_map_queue(map_queue, progress, cancellation_token, marathon_cache, max_workers)
+
+        check_cancelled(cancellation_token)
+        report_progress(progress, "Merging maps", 0, 1)
+        with Instrumentation.stage("merge_maps", maps=len(map_queue)):
+            merged_sections = MapProcessor.merge_maps(first_maps_sections,
+                                                      sections["hitobjects"],
+                                                      sections["timing_points"],
+                                                      sections["events"],
+                                                      sections["bookmarks"],
+                                                      break_length,
+                                                      sections["first_and_last_objects"])
+
+        # The metadata is copied once and then changed in place
+        metadata_section = KeyValueSection.from_section(merged_sections["Metadata"]).copy()
         for variable in ["Title", "TitleUnicode"]:
-            merged_sections["Metadata"] = MapProcessor.change_variable(
-                merged_sections["Metadata"], variable, marathon_title_name)
-
-        merged_sections["Metadata"] = MapProcessor.change_variable(
-            merged_sections["Metadata"], "Version", marathon_version_name)
+            metadata_section.set(variable, marathon_title_name)
+        metadata_section.set("Version", marathon_version_name)
+        merged_sections["Metadata"] = metadata_section
 
         new_file_name = f"{marathon_title_name}.osu"
         new_file_folder = join(
@@ -52,21 +78,29 @@ class MapGenerator:
                                                      merged_audio_directory,
                                                      break_length,
                                                      sections["first_and_last_objects"],
-                                                     map_queue)
+                                                     sections["rates"],
+                                                     progress,
+                                                     cancellation_token,
+                                                     marathon_cache,
+                                                     spool_directory,
+                                                     max_workers)
         merged_sections["General"] = MapProcessor.change_variable(
             merged_sections["General"],
             "AudioFilename",
             merged_audio_filename)
 
-        new_file_content = MapProcessor.combine_map_sections(
-            merged_sections)
-
+        check_cancelled(cancellation_token)
+        report_progress(progress, "Writing map", 0, 1)
         os.makedirs(new_file_folder, exist_ok=True)
-        MapGenerator.export_new_file(new_file_path, new_file_content)
+        with Instrumentation.stage("write_map", file=new_file_path):
+            # The merged sections are streamed into the file instead of being joined into one list first
+            MapGenerator.export_new_file(new_file_path, MapProcessor.iter_map_lines(merged_sections))
+        report_progress(progress, "Writing map", 1, 1)
         return new_file_path
 
     @staticmethod
-    def generate_single_map(rate, is_map_speed_with_bpm, od, ar, file_path) -> tuple[str, list[str]]:
+    @Instrumentation.timed("generate_single_map")
+    def generate_single_map(rate, is_map_speed_with_bpm, od, ar, file_path, audio_engine=PYDUB_ENGINE) -> tuple[str, Iterator[str]]:
         """
         Generate a single map based on the given parameters.
 
@@ -76,16 +110,269 @@ class MapGenerator:
         od (float): The overall difficulty of the map.
         ar (float): The approach rate of the map.
         file_path (str): The path to the osu! file.
+        audio_engine (str): The engine that changes the audio speed (PYDUB_ENGINE or FFMPEG_ENGINE).
 
         Returns:
         new_file_path (str): The path to the new osu! file.
-        new_file_contents (list[str]): The content of the new osu! file.
+        new_file_contents (Iterator[str]): The lines of the new osu! file, for export_new_file() to write.
+        """
+
+        with Instrumentation.stage("read_map", file=file_path):
+            file_sections = MapProcessor.read_osu_sections(
+                file_path=file_path)
+        new_file_path, new_file_contents, new_audio_file_path, map_rate = MapGenerator.change_map_rate(
+            file_sections, rate, is_map_speed_with_bpm, od, ar, file_path)
+        AudioProcessor.generate_map_audio(MapGenerator.get_audio_file_path(file_sections["General"], file_path),
+                                          new_audio_file_path, rate=map_rate, engine=audio_engine)
+        return new_file_path, new_file_contents
+
+    @staticmethod
+    def generate_single_maps(map_queue, max_workers=None, audio_engine=PYDUB_ENGINE,
+                             progress=None, cancellation_token=None) -> list[tuple[str, Exception]]:
+        """
+        Generate and export every map of the queue, spread over a pool of worker processes.
+        Every rate of every mapset folder is a task of its own, so the rates of a single map run in parallel too.
+        The workers share the decoded audio through the audio cache when it is enabled.
+
+        Parameters:
+        map_queue (list[tuple]): The list of maps to generate.
+        max_workers (int): The number of worker processes (None uses every core, 1 runs in this process).
+        audio_engine (str): The engine that changes the audio speed (PYDUB_ENGINE or FFMPEG_ENGINE).
+        progress (callable): Called as progress(stage, current, total) every time a task is done.
+        cancellation_token (CancellationToken): Once cancelled, the entries that haven't started fail with JobCancelledError.
+
+        Returns:
+        list[tuple[str, Exception]]: For every queue entry, the path of the new file and the error that stopped it (one of them is None).
+        """
+        # Entries that write the same rate changed audio (one rate of the maps of a folder) share a task,
+        # so every output file has a single writer. Outputs that still meet, like two BPMs that come to
+        # the same rate, are safe because the .osu and audio files are written atomically.
+        tasks_by_output = {}
+        for idx, (rate, is_map_speed_with_bpm, od, ar, file_path) in enumerate(map_queue):
+            output_key = (dirname(os.path.abspath(file_path)), rate, is_map_speed_with_bpm)
+            tasks_by_output.setdefault(output_key, []).append(idx)
+        tasks = list(tasks_by_output.values())
+
+        results = [None] * len(map_queue)
+        done_count = 0
+        report_progress(progress, "Generating maps", done_count, len(map_queue))
+        if max_workers == 1 or len(tasks) == 1:
+            for indices in tasks:
+                if cancellation_token is not None and cancellation_token.is_cancelled:
+                    map_results = [(None, JobCancelledError("The job was cancelled."))] * len(indices)
+                else:
+                    map_entries = [map_queue[idx] for idx in indices]
+                    map_results = MapGenerator.generate_and_export_maps(map_entries, audio_engine)
+                for idx, result in zip(indices, map_results):
+                    results[idx] = result
+                done_count += len(indices)
+                report_progress(progress, "Generating maps", done_count, len(map_queue))
+            return results
+
+        # Worker processes don't share class attributes on every platform, so hand them the caches
+        failed_indices = []
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=MapGenerator.set_worker_caches,
+                                 initargs=(AudioProcessor.audio_cache, MapProcessor.map_cache)) as executor:
+            futures = {}
+            for indices in tasks:
+                map_entries = [map_queue[idx] for idx in indices]
+                futures[executor.submit(MapGenerator.generate_and_export_maps, map_entries, audio_engine)] = indices
+
+            for future in as_completed(futures):
+                indices = futures[future]
+                if future.cancelled():
+                    map_results = [(None, JobCancelledError("The job was cancelled."))] * len(indices)
+                else:
+                    try:
+                        map_results = future.result()
+                    except Exception:
+                        # Entry errors are collected by the worker, so the task failed as a whole, like when a worker
+                        # crashes and every task still waiting fails with it. Its entries are retried one by one below.
+                        failed_indices.extend(indices)
+                        continue
+                for idx, result in zip(indices, map_results):
+                    results[idx] = result
+                done_count += len(indices)
+                report_progress(progress, "Generating maps", done_count, len(map_queue))
+
+                # Entries that haven't started yet are dropped, the running ones are left to finish
+                if cancellation_token is not None and cancellation_token.is_cancelled:
+                    for pending_future in futures:
+                        pending_future.cancel()
+
+        for idx in failed_indices:
+            if cancellation_token is not None and cancellation_token.is_cancelled:
+                results[idx] = (None, JobCancelledError("The job was cancelled."))
+            else:
+                results[idx] = MapGenerator.generate_isolated_map(map_queue[idx], audio_engine)
+            done_count += 1
+            report_progress(progress, "Generating maps", done_count, len(map_queue))
+        return results
+
+    @staticmethod
+    def generate_isolated_map(map_entry, audio_engine=PYDUB_ENGINE) -> tuple[str, Exception]:
         """
+        Generate and export one map queue entry in a worker process of its own,
+        so an entry that crashes its worker only fails itself
 
-        file_sections = MapProcessor.read_osu_sections(
-            file_path=file_path)
+        Parameters:
+        map_entry (tuple): The map queue entry to generate.
+        audio_engine (str): The engine that changes the audio speed (PYDUB_ENGINE or FFMPEG_ENGINE).
+
+        Returns:
+        tuple[str, Exception]: The path of the new file and the error that stopped it (one of them is None).
+        """
+        with ProcessPoolExecutor(max_workers=1,
+                                 initializer=MapGenerator.set_worker_caches,
+                                 initargs=(AudioProcessor.audio_cache, MapProcessor.map_cache)) as executor:
+            try:
+                return executor.submit(MapGenerator.generate_and_export_maps, [map_entry], audio_engine).result()[0]
+            except Exception as e:
+                return None, e
+
+    @staticmethod
+    def generate_and_export_maps(map_entries, audio_engine=PYDUB_ENGINE) -> list[tuple[str, Exception]]:
+        """
+        Generate and export map queue entries, collecting errors instead of raising them.
+        Every .osu file is read once for all its rates. Every audio file is decoded at most once
+        and each rate of it is rendered once, the other maps reference that file.
+
+        Parameters:
+        map_entries (list[tuple]): The map queue entries to generate.
+        audio_engine (str): The engine that changes the audio speed (PYDUB_ENGINE or FFMPEG_ENGINE).
+
+        Returns:
+        list[tuple[str, Exception]]: For every entry, the path of the new file and the error that stopped it (one of them is None).
+        """
+        # Every .osu file is read once, and parsed once if one of its entries is a BPM
+        read_maps = {}
+        for file_path in dict.fromkeys(map_entry[4] for map_entry in map_entries):
+            try:
+                with Instrumentation.stage("read_map", file=file_path):
+                    file_sections = MapProcessor.read_osu_sections(
+                        file_path=file_path)
+                read_maps[file_path] = (file_sections,
+                                        MapGenerator.get_audio_file_path(file_sections["General"], file_path))
+            except Exception as e:
+                read_maps[file_path] = e
+        parsed_maps = {}
+        audio_file_paths = [None if isinstance(read_maps[map_entry[4]], Exception) else read_maps[map_entry[4]][1]
+                            for map_entry in map_entries]
+
+        results = [None] * len(map_entries)
+        loaded_audio_file_path = loaded_audio = None
+        rendered_audio_file_paths = set()
+        # The entries are handled audio file by audio file, so only one decoded audio is kept at a time
+        for idx in sorted(range(len(map_entries)), key=lambda idx: audio_file_paths[idx] or ""):
+            rate, is_map_speed_with_bpm, od, ar, file_path = map_entries[idx]
+            try:
+                read_map = read_maps[file_path]
+                if isinstance(read_map, Exception):
+                    raise read_map
+                file_sections, audio_file_path = read_map
+                if is_map_speed_with_bpm and file_path not in parsed_maps:
+                    parsed_maps[file_path] = ParsedMap.from_sections(file_sections)
+                # change_map_rate copies the sections it changes, so every rate starts from the same read
+                new_file_path, new_file_contents, new_audio_file_path, map_rate = MapGenerator.change_map_rate(
+                    file_sections, rate, is_map_speed_with_bpm, od, ar, file_path, parsed_maps.get(file_path))
+
+                # Maps with the same audio and rate share the same rate changed audio file
+                if new_audio_file_path not in rendered_audio_file_paths:
+                    audio = audio_file_path
+                    if audio_engine == PYDUB_ENGINE:
+                        if audio_file_path != loaded_audio_file_path:
+                            # Let go of the previous audio before the next one is decoded
+                            loaded_audio_file_path = loaded_audio = None
+                            loaded_audio = AudioProcessor.load_audio(audio_file_path)
+                            loaded_audio_file_path = audio_file_path
+                        audio = loaded_audio
+                    AudioProcessor.generate_map_audio(
+                        audio, new_audio_file_path, rate=map_rate, engine=audio_engine)
+                    rendered_audio_file_paths.add(new_audio_file_path)
+
+                with Instrumentation.stage("write_map", file=new_file_path):
+                    MapGenerator.export_new_file(new_file_path, new_file_contents)
+                results[idx] = (new_file_path, None)
+            except Exception as e:
+                results[idx] = (None, e)
+        return results
+
+    @staticmethod
+    def get_audio_file_path(general_section, file_path) -> str:
+        # The audio file is stored relative to the folder of the map
+        return join(dirname(file_path), MapProcessor.get_variable(general_section, "AudioFilename"))
+
+    @staticmethod
+    def get_storyboard_file_path(metadata_section, file_path) -> str or None:
+        """
+        Get the .osb storyboard of a map's mapset
+
+        Parameters:
+        metadata_section (list): The Metadata section of the map.
+        file_path (str): The path to the osu! file.
+
+        Returns:
+        str: The path of the storyboard (None if the mapset doesn't have one)
+        """
+        # osu! names the storyboard after the metadata of the mapset
+        storyboard_file_name = (f"{MapProcessor.get_variable(metadata_section, 'Artist')} - "
+                                f"{MapProcessor.get_variable(metadata_section, 'Title')} "
+                                f"({MapProcessor.get_variable(metadata_section, 'Creator')}).osb")
+        storyboard_file_path = join(dirname(file_path), storyboard_file_name)
+        return storyboard_file_path if os.path.isfile(storyboard_file_path) else None
+
+    @staticmethod
+    def add_storyboard(new_file_sections, storyboard_file_path, map_rate) -> None:
+        """
+        Put the rate changed events of the mapset's .osb storyboard in the Events section of a new map.
+        The events are only read from the .osb while the new file is written, so they are never all in memory.
+
+        Parameters:
+        new_file_sections (dict): The sections of the new map, changed in place.
+        storyboard_file_path (str): The path of the .osb storyboard.
+        map_rate (float): The rate the map was changed to.
+        """
+        # The storyboard goes after the events of the map, in front of the empty lines that end the section
+        events_section = new_file_sections["Events"]
+        end = len(events_section)
+        while end > 0 and not events_section[end - 1].strip():
+            end -= 1
+        new_file_sections["Events"] = chain(events_section[:end],
+                                            MapProcessor.iter_storyboard_events(storyboard_file_path, map_rate),
+                                            events_section[end:])
+
+    @staticmethod
+    @Instrumentation.timed("change_map_rate")
+    def change_map_rate(file_sections, rate, is_map_speed_with_bpm, od, ar, file_path,
+                        parsed_map=None) -> tuple[str, Iterator[str], str, float]:
+        """
+        Change the rate of an already read map without touching its audio.
+
+        Parameters:
+        file_sections (dict): The sections of the map. They are not modified.
+        rate (float): The rate to change the map speed to.
+        is_map_speed_with_bpm (bool): Whether the map speed should be changed with BPM.
+        od (float): The overall difficulty of the map.
+        ar (float): The approach rate of the map.
+        file_path (str): The path to the osu! file.
+        parsed_map (ParsedMap): The parsed map, its timing is used for BPMs. (None parses file_sections when it is needed)
+
+        Returns:
+        new_file_path (str): The path to the new osu! file.
+        new_file_contents (Iterator[str]): The lines of the new osu! file. The storyboard of the mapset is read
+        as they are iterated, so they can only be written once.
+        new_audio_file_path (str): The path the rate changed audio should be exported to.
+        map_rate (float): The rate the map was changed to.
+        """
+        # The BPM of maps with several BPMs is weighted by how long it lasts until the last object ends
+        timing_points, last_object_time = file_sections["TimingPoints"], None
+        if is_map_speed_with_bpm:
+            if parsed_map is None:
+                parsed_map = ParsedMap.from_sections(file_sections)
+            timing_points, last_object_time = parsed_map.timing_index, parsed_map.last_object_time
         map_rate = MapProcessor.calculate_map_rate(
-            file_sections["TimingPoints"], rate, is_map_speed_with_bpm)
+            timing_points, rate, is_map_speed_with_bpm, last_object_time)
 
         file_folder = dirname(file_path)
         file_name = basename(file_path)
@@ -95,8 +382,6 @@ class MapGenerator:
 
         new_audio_file_name = f"{map_rate}x{MapProcessor.get_variable(file_sections['General'], 'AudioFilename')}"
         new_audio_file_path = join(file_folder, new_audio_file_name)
-        AudioProcessor.generate_map_audio(join(file_folder, MapProcessor.get_variable(
-            file_sections["General"], "AudioFilename")), new_audio_file_path, rate=map_rate)
 
         new_file_sections = MapProcessor.change_map_speed(
             sections=file_sections, rate=map_rate)
@@ -110,109 +395,168 @@ class MapGenerator:
             new_file_sections["Metadata"], "Version", new_version)
         new_file_sections["Difficulty"] = MapProcessor.change_od_and_ar(
             file_sections["Difficulty"], od, ar)
-        new_file_contents = MapProcessor.combine_map_sections(
-            new_file_sections)
-        return new_file_path, new_file_contents
+
+        storyboard_file_path = MapGenerator.get_storyboard_file_path(file_sections["Metadata"], file_path)
+        if storyboard_file_path is not None:
+            MapGenerator.add_storyboard(new_file_sections, storyboard_file_path, map_rate)
+        new_file_contents = MapProcessor.iter_map_lines(new_file_sections)
+        return new_file_path, new_file_contents, new_audio_file_path, map_rate
 
     @staticmethod
     def export_new_file(new_file_path, file_contents) -> None:
         """
         Export a new file to the specified path.
+        The lines are streamed into a temporary file next to it, which is synced to disk and renamed once complete,
+        so osu! never finds a half written map even if the generation crashes.
 
         Parameters:
         new_file_path (str): The file path to export the new file to.
-        file_contents (str): The contents of the new file (In this case, the modified .osu file).
+        file_contents (Iterable[str]): The lines of the new file (In this case, the modified .osu file).
         """
-        with open(new_file_path, 'w', encoding='utf-8') as file:
-            file.writelines(file_contents)
+        temporary_file_path = f"{new_file_path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_file_path, 'w', encoding='utf-8') as file:
+                file.writelines(file_contents)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_file_path, new_file_path)
+        except BaseException:
+            if os.path.exists(temporary_file_path):
+                os.remove(temporary_file_path)
+            raise
 
     @staticmethod
-    def handle_map_queue(map_queue) -> dict:
+    @Instrumentation.timed("handle_map_queue")
+    def handle_map_queue(map_queue, progress=None, cancellation_token=None, marathon_cache=None,
+                         max_workers=None) -> dict:
         """
-        Convert the map queue to a dict of sections (HitObjects, TimingPoints, Events, Bookmarks) for the generate_marathon function to merge them
+        Convert the map queue to a dict of sections (HitObjects, TimingPoints, Events, Bookmarks) for the generate_marathon function to merge them.
+        Once the maps to prepare add up to PARALLEL_MAP_BYTES, they are prepared in a pool of worker processes
+        and put back in the order of the queue.
 
         Parameters:
         map_queue (list[tuple]): The map queue to convert to the sections listed above.
+        progress (callable): Called as progress(stage, current, total) after each map.
+        cancellation_token (CancellationToken): Stops between maps with JobCancelledError once cancelled.
+        marathon_cache (MarathonCache): Reuses the maps that haven't changed since they were last prepared. Can be None.
+        max_workers (int): The number of worker processes (None uses every core, 1 runs in this process).
 
         Returns:
         sections (dict): The organized sections for the generate_marathon function
         """
-        # Initialize sections
-        sections = {
-            "hitobjects": [],
-            "timing_points": [],
-            "events": [],
-            "bookmarks": [],
-            "audio_files": [],
-            "first_and_last_objects": []
+        prepared_maps = [None] * len(map_queue)
+        if marathon_cache is not None:
+            for idx, (rate, is_map_speed_with_bpm, od, ar, file_path) in enumerate(map_queue):
+                prepared_maps[idx] = marathon_cache.get_map(file_path, rate, is_map_speed_with_bpm)
+        pending_indices = [idx for idx, prepared_map in enumerate(prepared_maps) if prepared_map is None]
+
+        done_count = len(map_queue) - len(pending_indices)
+        report_progress(progress, "Reading maps", done_count, len(map_queue))
+        if not MapGenerator.is_worth_a_pool([map_queue[idx][4] for idx in pending_indices], max_workers):
+            for idx in pending_indices:
+                check_cancelled(cancellation_token)
+                rate, is_map_speed_with_bpm, od, ar, file_path = map_queue[idx]
+                with Instrumentation.stage("prepare_map", map=idx, file=file_path):
+                    prepared_maps[idx] = MapGenerator.prepare_marathon_map(rate, is_map_speed_with_bpm, file_path)
+                done_count += 1
+                report_progress(progress, "Reading maps", done_count, len(map_queue))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     initializer=MapGenerator.set_worker_caches,
+                                     initargs=(AudioProcessor.audio_cache, MapProcessor.map_cache)) as executor:
+                futures = {}
+                for idx in pending_indices:
+                    rate, is_map_speed_with_bpm, od, ar, file_path = map_queue[idx]
+                    futures[executor.submit(MapGenerator.prepare_marathon_map,
+                                            rate, is_map_speed_with_bpm, file_path)] = idx
+                try:
+                    for future in as_completed(futures):
+                        check_cancelled(cancellation_token)
+                        prepared_maps[futures[future]] = future.result()
+                        done_count += 1
+                        report_progress(progress, "Reading maps", done_count, len(map_queue))
+                except BaseException:
+                    # Maps that haven't started yet are dropped, the running ones are left to finish
+                    for pending_future in futures:
+                        pending_future.cancel()
+                    raise
+
+        if marathon_cache is not None:
+            for idx in pending_indices:
+                rate, is_map_speed_with_bpm, od, ar, file_path = map_queue[idx]
+                marathon_cache.put_map(file_path, rate, is_map_speed_with_bpm, prepared_maps[idx])
+
+        # Organize the sections in the order of the queue
+        return {
+            "hitobjects": [prepared_map["hitobjects"] for prepared_map in prepared_maps],
+            "timing_points": [prepared_map["timing_points"] for prepared_map in prepared_maps],
+            "events": [prepared_map["events"] for prepared_map in prepared_maps],
+            "bookmarks": [prepared_map["bookmarks"] for prepared_map in prepared_maps],
+            "audio_files": [prepared_map["audio_file"] for prepared_map in prepared_maps],
+            "first_and_last_objects": [prepared_map["first_and_last_objects"] for prepared_map in prepared_maps],
+            "rates": [prepared_map["rate"] for prepared_map in prepared_maps]
         }
 
-        for rate, is_map_speed_with_bpm, od, ar, file_path in map_queue:
-            # Get each maps sections
-            file_sections = MapProcessor.read_osu_sections(
-                file_path=file_path)
-
-            # Calculate the rate
-            rate = MapProcessor.calculate_map_rate(
-                file_sections["TimingPoints"], rate, is_map_speed_with_bpm)
-
-            # Change the map speed according to the rate
-            new_file_sections = MapProcessor.change_map_speed(
-                file_sections, rate)
-
-            new_bookmarks = MapProcessor.get_variable(
-                new_file_sections["Editor"], "Bookmarks")
-            # Append the sections and the first and last object time
-            sections["hitobjects"].append(new_file_sections["HitObjects"])
-            sections["timing_points"].append(new_file_sections["TimingPoints"])
-            sections["events"].append(new_file_sections["Events"])
-            sections["bookmarks"].append(new_bookmarks)
-            sections["audio_files"].append(join(dirname(file_path),
-                                           MapProcessor.get_variable(file_sections["General"],
-                                                                     "AudioFilename")))
-            first_object_time, last_object_time = MapGenerator.get_first_and_last_objects_time(
-                file_sections["HitObjects"][1:])
-            sections["first_and_last_objects"].append(
-                (first_object_time / rate, last_object_time / rate))
-
-        return sections
+    @staticmethod
+    def set_worker_caches(audio_cache, map_cache) -> None:
+        # Initializer of the worker processes
+        AudioProcessor.set_audio_cache(audio_cache)
+        MapProcessor.set_map_cache(map_cache)
 
     @staticmethod
-    def get_first_and_last_objects_time(hit_objects) -> tuple[int, int]:
+    def is_worth_a_pool(file_paths, max_workers=None) -> bool:
         """
-        Get the first and last object time.
+        Check if preparing maps in worker processes pays for starting them
 
         Parameters:
-        hit_objects (list): The hit objects to get the first and last object time.
+        file_paths (list[str]): The .osu files to prepare
+        max_workers (int): The number of worker processes (None uses every core, 1 runs in this process)
 
         Returns:
-        tuple[int, int]: The first and last object time.
+        bool: True if there is more than one core and map to use and the maps add up to PARALLEL_MAP_BYTES
         """
+        if max_workers == 1 or (os.cpu_count() or 1) == 1 or len(file_paths) <= 1:
+            return False
+        total_bytes = 0
+        for file_path in file_paths:
+            # Missing files fail when they are prepared, with the error of the map they belong to
+            if os.path.isfile(file_path):
+                total_bytes += os.path.getsize(file_path)
+        return total_bytes >= PARALLEL_MAP_BYTES
 
-        # Find the first non-empty hit object
-        first_object = hit_objects[0]
-
-        # Extract time from the first hit object
-        first_object_time = int(first_object.strip().split(',')[2])
-
-        # Find the last non-empty hit object
-        last_object = None
-        for obj in reversed(hit_objects):
-            if obj.strip():
-                last_object = obj
-                break
+    @staticmethod
+    def prepare_marathon_map(rate, is_map_speed_with_bpm, file_path) -> dict:
+        """
+        Read a map of a marathon and change its speed
 
-        # Extract object properties
-        last_object_elements = last_object.strip().split(',')
-        last_object_type = int(last_object_elements[3])
+        Parameters:
+        rate (float): The rate (or BPM) of the map queue entry.
+        is_map_speed_with_bpm (bool): Whether the rate is a BPM.
+        file_path (str): The path to the osu! file.
 
-        # Extract time from the last hit object
-        last_object_time = int(last_object_elements[2])
+        Returns:
+        dict: The rate changed hitobjects, timing_points, events and bookmarks, the audio_file,
+        the first_and_last_objects times and the rate the map was changed to.
+        """
+        # Get each maps sections
+        parsed_map = MapProcessor.read_parsed_map(file_path)
+        file_sections = parsed_map.sections
 
-        # If the last object is a long note or spinner adjust the time accordingly
-        if MapProcessor.is_hold_note(last_object_type):
-            last_object_time = int(last_object_elements[5].split(':')[0])
-        elif MapProcessor.is_spinner(last_object_type):
-            last_object_time = int(last_object_elements[5])
+        # Calculate the rate
+        rate = MapProcessor.calculate_map_rate(
+            parsed_map.timing_index, rate, is_map_speed_with_bpm, parsed_map.last_object_time)
 
-        return first_object_time, last_object_time
+        # Change the map speed according to the rate
+        new_file_sections = MapProcessor.change_map_speed(
+            file_sections, rate)
+
+        first_object_time, last_object_time = parsed_map.first_object_time, parsed_map.last_object_time
+        return {
+            "hitobjects": new_file_sections["HitObjects"],
+            "timing_points": new_file_sections["TimingPoints"],
+            "events": new_file_sections["Events"],
+            "bookmarks": MapProcessor.get_variable(new_file_sections["Editor"], "Bookmarks"),
+            "audio_file": MapGenerator.get_audio_file_path(file_sections["General"], file_path),
+            "first_and_last_objects": (first_object_time / rate, last_object_time / rate),
+            "rate": rate
+        }
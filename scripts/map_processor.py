@@ -1,38 +1,164 @@
 from math import floor
 from os.path import join, dirname
+from .hit_objects import HitObjectsTable
+from .key_value_section import KeyValueSection, KEY_VALUE_SECTIONS
+from .map_cache import MapCache, ParsedMap, DEFAULT_MAP_CACHE_DIRECTORY, DEFAULT_MAX_MAP_CACHE_BYTES
+from .timing_index import TimingIndex
 
 class MapProcessor:
     # Class to read, process and write .osu files
     DEFAULT_FILE_FORMAT = 'osu file format v14'
+    # Parsed maps are only cached on disk once enable_map_cache() is called
+    map_cache = None
+
     @staticmethod
-    def read_osu_sections(file_path) -> dict:
+    def enable_map_cache(cache_directory=DEFAULT_MAP_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_MAP_CACHE_BYTES) -> None:
         """
-        Get the sections of an .osu file as a dictionary
+        Keep parsed maps on disk so reading the same .osu file again doesn't parse its text
+
+        Parameters:
+        cache_directory (str): The folder to store the parsed maps in
+        max_bytes (int): The maximum size of the cache in bytes
+        """
+        MapProcessor.set_map_cache(MapCache(cache_directory, max_bytes))
+
+    @staticmethod
+    def set_map_cache(map_cache) -> None:
+        # Also used to pass the cache on to worker processes
+        MapProcessor.map_cache = map_cache
+
+    @staticmethod
+    def disable_map_cache() -> None:
+        MapProcessor.map_cache = None
+
+    @staticmethod
+    def iter_osu_sections(file_path, section_names=None):
+        """
+        Read the sections of an .osu file one at a time without loading the whole file
 
         Parameters:
         file_path (str): The path of the file to read
+        section_names (list[str]): The sections to read. Reading stops once all of them are found. (None reads every section)
 
-        Returns:
-        sections (dict): The sections of the file organized as a dictionary
+        Yields:
+        tuple[str, list]: The section name and its lines (a KeyValueSection for General, Editor, Metadata and Difficulty)
+
+        Usage:
+        for section_name, lines in iter_osu_sections(file_path, ["General"]):
+            audio_filename = get_variable(lines, "AudioFilename")
         """
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                lines = file.readlines()
-            sections = {}
+        remaining_sections = set(section_names) if section_names is not None else None
+        with open(file_path, 'r', encoding='utf-8') as file:
             current_section = None
-            for line in lines:
+            current_lines = None
+            for line in file:
                 strip_line = line.strip()
                 if strip_line.startswith('[') and strip_line.endswith(']'):
+                    if current_lines is not None:
+                        yield current_section, MapProcessor.index_section(current_section, current_lines)
+                        # Stop reading once every requested section has been found
+                        if remaining_sections is not None:
+                            remaining_sections.discard(current_section)
+                            if not remaining_sections:
+                                return
                     current_section = strip_line[1:-1]
-                    sections[current_section] = [line]
-                elif current_section:
-                    sections[current_section].append(line)
-            return sections
+                    # Lines of sections that weren't requested are skipped instead of stored
+                    if remaining_sections is None or current_section in remaining_sections:
+                        current_lines = [line]
+                    else:
+                        current_lines = None
+                elif current_lines is not None:
+                    current_lines.append(line)
+            if current_lines is not None:
+                yield current_section, MapProcessor.index_section(current_section, current_lines)
+
+    @staticmethod
+    def index_section(section_name, lines) -> list or KeyValueSection:
+        # Key/value sections are indexed so their variables can be read and changed without scanning them
+        return KeyValueSection(lines) if section_name in KEY_VALUE_SECTIONS else lines
+
+    @staticmethod
+    def read_osu_sections(file_path, section_names=None) -> dict:
+        """
+        Get the sections of an .osu file as a dictionary
+
+        Parameters:
+        file_path (str): The path of the file to read
+        section_names (list[str]): The sections to read (None reads every section)
+
+        Returns:
+        sections (dict): The sections of the file organized as a dictionary
+        """
+        try:
+            if MapProcessor.map_cache is None:
+                return dict(MapProcessor.iter_osu_sections(file_path, section_names))
+            if section_names is None:
+                parsed_map = MapProcessor.map_cache.get(file_path)
+                if parsed_map is not None:
+                    return parsed_map.sections
+                sections = dict(MapProcessor.iter_osu_sections(file_path))
+                try:
+                    MapProcessor.parse_map(file_path, sections)
+                except ValueError:
+                    # A map with malformed timing or objects isn't cached, its sections are read like without the cache
+                    pass
+                return sections
+            # Reading a few sections stops early, so only a map that is already cached is used for them
+            parsed_map = MapProcessor.map_cache.get(file_path)
+            if parsed_map is None:
+                return dict(MapProcessor.iter_osu_sections(file_path, section_names))
+            return {name: lines for name, lines in parsed_map.sections.items() if name in section_names}
         except FileNotFoundError:
             raise FileNotFoundError(f"Could not find file {file_path}.")
         except Exception as e:
             print(f"An error occurred while reading the file: {e}")
 
+    @staticmethod
+    def read_parsed_map(file_path) -> ParsedMap:
+        """
+        Get the sections, timing points and first and last object times of an .osu file.
+        They come from the map cache when it is enabled and the file hasn't changed.
+        A map with malformed timing points or hit objects raises a ValueError naming the file.
+
+        Parameters:
+        file_path (str): The path of the file to read
+
+        Returns:
+        ParsedMap: The parsed map
+        """
+        map_cache = MapProcessor.map_cache
+        if map_cache is not None:
+            parsed_map = map_cache.get(file_path)
+            if parsed_map is not None:
+                return parsed_map
+
+        return MapProcessor.parse_map(file_path, dict(MapProcessor.iter_osu_sections(file_path)))
+
+    @staticmethod
+    def parse_map(file_path, sections) -> ParsedMap:
+        """
+        Parse the timing points and first and last object times of a read .osu file and store them in the map cache
+
+        Parameters:
+        file_path (str): The path of the file the sections were read from
+        sections (dict): The sections of the file organized as a dictionary
+
+        Returns:
+        ParsedMap: The parsed map
+        """
+        try:
+            parsed_map = ParsedMap.from_sections(sections)
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"Could not parse the timing points or hit objects of {file_path}: {e}") from e
+
+        if MapProcessor.map_cache is not None:
+            try:
+                MapProcessor.map_cache.put(file_path, parsed_map)
+            except OSError:
+                # A cache that can't be written only makes the next read slower
+                pass
+        return parsed_map
+
     @staticmethod
     def combine_map_sections(sections) -> list[str]:
         """
@@ -44,11 +170,23 @@ class MapProcessor:
         Returns:
         new_file (list): The new file as a list to write to a new file
         """
-        new_file = ['osu file format v14\n']
-        # Get the values and add them to the new file list (assuming they're in the correct order)
+        return list(MapProcessor.iter_map_lines(sections))
+
+    @staticmethod
+    def iter_map_lines(sections):
+        """
+        Yield the lines of a new file section by section, without building the whole file first
+
+        Parameters:
+        sections (dict): The sections of the file organized as a dictionary
+
+        Yields:
+        str: The lines of the new file
+        """
+        yield 'osu file format v14\n'
+        # Get the values and add them to the new file (assuming they're in the correct order)
         for value in sections.values():
-            new_file.extend(value)
-        return new_file
+            yield from value
 
     @staticmethod
     def is_hold_note(num) -> bool:
@@ -63,7 +201,7 @@ class MapProcessor:
         return num & 8 != 0
 
     @staticmethod
-    def change_hitobjects_speed(hitobjects_section, rate) -> None:
+    def change_hitobjects_speed(hitobjects_section, rate) -> list:
         """
         Change the timing info of all hitobjects to match the rate
 
@@ -74,40 +212,9 @@ class MapProcessor:
         Returns:
         modified_hitobjects_section (list): The updated HitObjects section
         """
-        modified_hitobjects_section = []
-        for line in hitobjects_section:
-            # Get the elements of a line
-            line_elements = line.strip().split(',')
-            if len(line_elements) >= 3:
-                # Extract type and time information
-                type_of_object = int(line_elements[3])
-                original_start_time = int(line_elements[2])
-                modified_start_time = floor(original_start_time / rate)
-                line_elements[2] = str(modified_start_time)
-
-                # Check and modify long notes accordingly
-                if MapProcessor.is_hold_note(type_of_object):
-                    split_note_params = line_elements[5].split(':')
-                    original_end_time = int(split_note_params[0])
-                    modified_end_time = floor(original_end_time / rate)
-                    split_note_params[0] = str(modified_end_time)
-                    note_params = ':'.join(split_note_params)
-                    line_elements[5] = str(note_params)
-
-                # Check and modify spinners accordingly
-                elif MapProcessor.is_spinner(type_of_object):
-                    original_end_time = int(line_elements[5])
-                    modified_end_time = floor(original_end_time / rate)
-                    line_elements[5] = str(modified_end_time)
-
-                # Reconstruct the line and add it to the new list
-                modified_line = ','.join(line_elements)
-                modified_hitobjects_section.append(modified_line + '\n')
-            else:
-                # If it's not a hitobject, just append the line as normal
-                modified_hitobjects_section.append(line)
-
-        return modified_hitobjects_section
+        # Parse the section once and divide every timing with one vectorized operation
+        table = HitObjectsTable.from_section(hitobjects_section)
+        return table.change_speed(rate).to_section()
 
     @staticmethod
     def change_events_speed(events_section, rate) -> list:
@@ -121,55 +228,97 @@ class MapProcessor:
         Returns:
         modified_events_section (list): The updated Events section
         """
-        modified_events_section = []
-        for line in events_section:
-            # Get the elements of a line
-            line_elements = line.rstrip().split(',')
+        return [MapProcessor.change_event_line_speed(line, rate) for line in events_section]
 
-            # Parse the event type
-            event_type = line_elements[0].strip()
+    @staticmethod
+    def change_event_line_speed(line, rate) -> str:
+        """
+        Change the timing info of one line of an Events section (of an .osu or .osb file) to match the rate
 
-            # If we have an event type and it's not the header, continue
-            if event_type != "[Events]":
-                # If it's a background, just append the line as normal
-                if event_type == "0":
-                    modified_events_section.append(line)
-                else:
-                    # Change timing info on Videos and Loops
-                    if event_type in ["Video", "1", "_L", "L"]:
-                        if len(line_elements) >= 2:
-                            original_start_time = int(line_elements[1])
-                            modified_start_time = floor(
-                                original_start_time / rate)
-                            line_elements[1] = str(modified_start_time)
-                    # Change timing info of Breaks
-                    elif event_type in ["2", "Break"]:
-                        if len(line_elements) >= 3:
-                            original_start_time = int(line_elements[1])
-                            original_end_time = int(line_elements[2])
-                            modified_start_time = floor(
-                                original_start_time / rate)
-                            modified_end_time = floor(original_end_time / rate)
-                            line_elements[1] = str(modified_start_time)
-                            line_elements[2] = str(modified_end_time)
-                    # Change timing info for other Events and Storyboard Commands
-                    elif len(event_type) <= 3 and len(line_elements) >= 3:
-                        original_start_time = int(line_elements[2])
-                        modified_start_time = floor(original_start_time / rate)
-                        line_elements[2] = str(modified_start_time)
-
-                        # Check if there is an end time (index 3) because sometimes its empty
-                        if line_elements[3]:
-                            original_end_time = int(line_elements[3])
-                            modified_end_time = floor(original_end_time / rate)
-                            line_elements[3] = str(modified_end_time)
+        Parameters:
+        line (str): The line
+        rate (float): The rate to update the line's timing info
 
-                    modified_line = ','.join(line_elements)
-                    modified_events_section.append(modified_line + '\n')
-            else:
-                modified_events_section.append(line)
+        Returns:
+        str: The updated line
+        """
+        # Get the elements of a line
+        line_elements = line.rstrip().split(',')
+
+        # Parse the event type
+        event_type = line_elements[0].strip()
+
+        # If it's the header or a background, just return the line as normal
+        if event_type in ["[Events]", "0"]:
+            return line
+
+        # Change timing info on Videos, Loops and Samples
+        if event_type in ["Video", "1", "_L", "L", "Sample", "5"]:
+            if len(line_elements) >= 2:
+                original_start_time = int(line_elements[1])
+                modified_start_time = floor(
+                    original_start_time / rate)
+                line_elements[1] = str(modified_start_time)
+        # Change timing info of Breaks
+        elif event_type in ["2", "Break"]:
+            if len(line_elements) >= 3:
+                original_start_time = int(line_elements[1])
+                original_end_time = int(line_elements[2])
+                modified_start_time = floor(
+                    original_start_time / rate)
+                modified_end_time = floor(original_end_time / rate)
+                line_elements[1] = str(modified_start_time)
+                line_elements[2] = str(modified_end_time)
+        # Change timing info for other Events and Storyboard Commands
+        elif len(event_type) <= 3 and len(line_elements) >= 3:
+            original_start_time = int(line_elements[2])
+            modified_start_time = floor(original_start_time / rate)
+            line_elements[2] = str(modified_start_time)
+
+            # Check if there is an end time (index 3) because sometimes its empty
+            if line_elements[3]:
+                original_end_time = int(line_elements[3])
+                modified_end_time = floor(original_end_time / rate)
+                line_elements[3] = str(modified_end_time)
+
+        return ','.join(line_elements) + '\n'
 
-        return modified_events_section
+    @staticmethod
+    def iter_storyboard_events(storyboard_file_path, rate):
+        """
+        Yield the events of an .osb storyboard with their timing info changed to match the rate.
+        The file is streamed line by line, so even very large storyboards use little memory.
+        The [Variables] of the storyboard are put in the events, so they can be used outside of the .osb.
+
+        Parameters:
+        storyboard_file_path (str): The path of the .osb file
+        rate (float): The rate to update the storyboard's timing info
+
+        Yields:
+        str: The lines of the storyboard's Events section, without its header
+        """
+        variables = []
+        try:
+            with open(storyboard_file_path, 'r', encoding='utf-8') as file:
+                current_section = None
+                for line in file:
+                    strip_line = line.strip()
+                    if strip_line.startswith('[') and strip_line.endswith(']'):
+                        current_section = strip_line[1:-1]
+                        # Longer names first, so a variable is never replaced by one that is a prefix of its name
+                        variables.sort(key=lambda variable: len(variable[0]), reverse=True)
+                        continue
+                    if current_section == "Variables":
+                        name, separator, value = strip_line.partition('=')
+                        if separator and name.startswith('$'):
+                            variables.append((name, value))
+                    elif current_section == "Events" and strip_line:
+                        for name, value in variables:
+                            line = line.replace(name, value)
+                        line = MapProcessor.change_event_line_speed(line, rate)
+                        yield line if line.endswith('\n') else line + '\n'
+        except (OSError, UnicodeDecodeError) as e:
+            raise ValueError(f"Could not read the storyboard {storyboard_file_path}: {e}") from e
 
     @staticmethod
     def change_timing_points_speed(timing_points_section, rate) -> list:
@@ -235,9 +384,10 @@ class MapProcessor:
         return new_bookmarks
 
     @staticmethod
-    def change_variable(section, variable, new_variable) -> list:
+    def change_variable(section, variable, new_variable) -> KeyValueSection:
         """
-        Change one variable of a section
+        Change one variable of a section. The section isn't modified, use KeyValueSection.set() to change
+        several variables of a copy.
 
         Parameters:
         section (list): The section to change the variable of
@@ -245,19 +395,14 @@ class MapProcessor:
         new_variable (str): The updated variable
 
         Returns:
-        modified_section (list): The section with the updated variable
+        modified_section (KeyValueSection): The section with the updated variable
 
         Usage:
-        section = file_sections["Bookmarks"]
+        section = file_sections["Editor"]
         section = change_variable(section, "Bookmarks", "128, 695, 900, 10023")
         """
-        modified_section = []
-        for line in section:
-            if line.startswith(variable):
-                modified_line = f"{variable}: {new_variable}"
-                modified_section.append(modified_line + '\n')
-            else:
-                modified_section.append(line)
+        modified_section = KeyValueSection.from_section(section).copy()
+        modified_section.set(variable, new_variable)
         return modified_section
 
     @staticmethod
@@ -272,15 +417,7 @@ class MapProcessor:
         Returns:
         str: The variable value
         """
-        for line in section:
-            if line.startswith(variable):
-                # Most variables are separated with a colon
-                line_elements = line.split(':')
-                if len(line_elements) >= 2:
-                    return ':'.join(line_elements[1:]).strip()
-                else:
-                    return None
-        return None
+        return KeyValueSection.from_section(section).get(variable)
 
     @staticmethod
     def merge_hitobjects(sections, break_length, first_and_last_objects) -> list:
@@ -298,39 +435,17 @@ class MapProcessor:
         Usage:
         merged_hitobjects = merge_hitobjects(sections,break_length,first_and_last_objects)
         """
-        merged_hitobjects = ['[HitObjects]\n']
+        shifted_tables = []
         current_offset = 0
         for idx, lines in enumerate(sections):
             current_offset -= first_and_last_objects[idx][0]
-            for line in lines:
-                line_elements = line.strip().split(',')
-                if len(line_elements) >= 3:
-                    type_of_object = int(line_elements[3])
-                    original_start_time = int(line_elements[2])
-
-                    modified_start_time = floor(
-                        original_start_time + current_offset)
-                    line_elements[2] = str(modified_start_time)
-
-                    if MapProcessor.is_hold_note(type_of_object):
-                        split_object_params = line_elements[5].split(':')
-                        original_end_time = int(split_object_params[0])
-                        modified_end_time = floor(
-                            original_end_time + current_offset)
-                        split_object_params[0] = str(modified_end_time)
-                        object_params = ':'.join(split_object_params)
-                        line_elements[5] = object_params
-                    elif MapProcessor.is_spinner(type_of_object):
-                        original_end_time = int(line_elements[5])
-                        modified_end_time = floor(original_end_time + current_offset)
-                        line_elements[5] = str(modified_end_time)
-
-                    modified_line = ','.join(line_elements)
-                    merged_hitobjects.append(modified_line + '\n')
-                else:
-                    continue
+            # Shift every hit object of the map at once
+            table = HitObjectsTable.from_section(lines)
+            shifted_tables.append(table.shift(current_offset))
             current_offset += floor(first_and_last_objects[idx][1] + break_length)
-        return merged_hitobjects
+
+        merged_table = HitObjectsTable.concatenate(shifted_tables)
+        return ['[HitObjects]\n'] + merged_table.to_section(keep_other_lines=False)
 
     @staticmethod
     def merge_timing_points(sections, break_length, first_and_last_objects) -> list:
@@ -526,13 +641,16 @@ class MapProcessor:
         return uninherited_timing_points
 
     @staticmethod
-    def convert_bpm_to_rate(timing_points, beats_per_minute):
+    def convert_bpm_to_rate(timing_points, beats_per_minute, last_object_time=None):
         """
-        Convert a single bpm to rate. Raise ValueError if there are multiple.
+        Convert a bpm to rate. Maps with several BPMs are converted so their dominant BPM (the one that lasts
+        the longest) becomes the target. Raise ValueError if the map has no uninherited timing point.
 
         Parameters:
-        timing_points (list): The TimingPoints section.
+        timing_points (list or TimingIndex): The TimingPoints section, or the timing index of the map.
         beats_per_minute (int): The target bpm to convert to rate.
+        last_object_time (int): The end of the last object, where the last BPM of the map stops counting.
+        (None stops at the last uninherited timing point)
 
         Returns:
         map_rate (float): The rate to update HitObjects, TimingPoints, Events and Bookmarks.
@@ -540,16 +658,10 @@ class MapProcessor:
         Usage:
         map_rate = convert_bpm_to_rate(timing_points,beats_per_minute)
         """
-        uninherited_timing_points = MapProcessor.get_uninherited_timing_points(
-            timing_points)
-
-        if len(uninherited_timing_points) > 1:
-            raise ValueError(
-                "Please select a map with only one uninherited Timing Point!")
-        else:
-            original_bpm = MapProcessor.get_bpm_from_timing_point(
-                uninherited_timing_points[0])
-            map_rate = beats_per_minute / original_bpm
+        if not isinstance(timing_points, TimingIndex):
+            timing_points = TimingIndex.from_section(timing_points)
+        original_bpm = timing_points.get_dominant_bpm(last_object_time)
+        map_rate = beats_per_minute / original_bpm
 
         return map_rate
 
@@ -573,8 +685,8 @@ class MapProcessor:
         return beats_per_minute
 
     @staticmethod
-    def calculate_map_rate(timing_points, rate, is_map_speed_with_bpm):
-        return MapProcessor.convert_bpm_to_rate(timing_points[1:], rate) if is_map_speed_with_bpm else rate
+    def calculate_map_rate(timing_points, rate, is_map_speed_with_bpm, last_object_time=None):
+        return MapProcessor.convert_bpm_to_rate(timing_points, rate, last_object_time) if is_map_speed_with_bpm else rate
 
     @staticmethod
     def change_map_speed(sections, rate):
@@ -589,7 +701,7 @@ class MapProcessor:
         new_file_sections (dict): The updated sections
         """
         if rate == 1.0:
-            return sections
+            return sections.copy()
         new_file_sections = sections.copy()
         new_file_sections["HitObjects"] = MapProcessor.change_hitobjects_speed(new_file_sections["HitObjects"],
                                                                                rate)
@@ -621,11 +733,9 @@ class MapProcessor:
         Returns:
         modified_difficulty_section (list): The updated difficulty section
         """
-        modified_difficulty_section = difficulty_section.copy()
+        modified_difficulty_section = KeyValueSection.from_section(difficulty_section).copy()
         if overall_difficulty:
-            modified_difficulty_section = MapProcessor.change_variable(
-                modified_difficulty_section, "OverallDifficulty", str(overall_difficulty))
+            modified_difficulty_section.set("OverallDifficulty", str(overall_difficulty))
         if approach_rate:
-            modified_difficulty_section = MapProcessor.change_variable(
-                modified_difficulty_section, "ApproachRate", str(approach_rate))
+            modified_difficulty_section.set("ApproachRate", str(approach_rate))
         return modified_difficulty_section
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import tempfile
+from os.path import join
+from .audio_cache import AudioCache, CACHE_EXTENSION
+
+MAP_EXTENSION = '.json'
+# Part of the key of the prepared maps, raised when the way maps are prepared changes
+MAP_FORMAT_VERSION = 2
+DEFAULT_MARATHON_CACHE_DIRECTORY = join(tempfile.gettempdir(), "Xerate", "marathon_cache")
+DEFAULT_MAX_MARATHON_CACHE_BYTES = 2 * 1024 ** 3
+
+
+class MarathonCache:
+    # Class to keep the prepared maps and audio segments of marathons on disk,
+    # so rebuilding a marathon only prepares the maps that changed.
+    # The folder outlives the process, so the prepared maps and segments share one budget.
+    def __init__(self, cache_directory=DEFAULT_MARATHON_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_MARATHON_CACHE_BYTES) -> None:
+        """
+        Parameters:
+        cache_directory (str): The folder to store the prepared maps and audio segments in
+        max_bytes (int): The maximum size of the prepared maps and audio segments. The least recently used ones are removed past it.
+        """
+        self.cache_directory = cache_directory
+        # The segment cache evicts the prepared maps of the folder too
+        self.segment_cache = AudioCache(cache_directory, max_bytes, (CACHE_EXTENSION, MAP_EXTENSION))
+
+    @staticmethod
+    def hash_key(*parts) -> str:
+        return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_map_key(file_path, rate, is_map_speed_with_bpm) -> str:
+        """
+        Get the cache key of a prepared map from the inputs of the preparation
+
+        Parameters:
+        file_path (str): The path of the .osu file, its size and modification time are part of the key
+        rate (float): The rate (or BPM) of the map queue entry
+        is_map_speed_with_bpm (bool): Whether the rate is a BPM
+
+        Returns:
+        str: The cache key
+        """
+        file_stat = os.stat(file_path)
+        return MarathonCache.hash_key("map", MAP_FORMAT_VERSION, os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns,
+                                      rate, is_map_speed_with_bpm)
+
+    def get_map_path(self, key) -> str:
+        return join(self.cache_directory, key + MAP_EXTENSION)
+
+    def get_map(self, file_path, rate, is_map_speed_with_bpm) -> dict or None:
+        """
+        Get a prepared map if its .osu file hasn't changed since it was stored
+
+        Parameters:
+        file_path (str): The path of the .osu file
+        rate (float): The rate (or BPM) of the map queue entry
+        is_map_speed_with_bpm (bool): Whether the rate is a BPM
+
+        Returns:
+        dict: The prepared map (None if it isn't cached)
+        """
+        map_path = self.get_map_path(self.get_map_key(file_path, rate, is_map_speed_with_bpm))
+        try:
+            with open(map_path, 'r', encoding='utf-8') as file:
+                prepared_map = json.load(file)
+            # Mark the entry as recently used
+            os.utime(map_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        # JSON has no tuples
+        prepared_map["first_and_last_objects"] = tuple(prepared_map["first_and_last_objects"])
+        return prepared_map
+
+    def put_map(self, file_path, rate, is_map_speed_with_bpm, prepared_map) -> None:
+        """
+        Store a prepared map and evict the least recently used entries if the cache is full
+
+        Parameters:
+        file_path (str): The path of the .osu file
+        rate (float): The rate (or BPM) of the map queue entry
+        is_map_speed_with_bpm (bool): Whether the rate is a BPM
+        prepared_map (dict): The map as prepared by MapGenerator.prepare_marathon_map()
+        """
+        map_path = self.get_map_path(self.get_map_key(file_path, rate, is_map_speed_with_bpm))
+        # Write to a temporary file first so other processes never read a half written entry
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as file:
+                json.dump(prepared_map, file)
+            os.replace(temporary_path, map_path)
+        except Exception:
+            os.remove(temporary_path)
+            raise
+
+        self.segment_cache.evict()
+
+    @staticmethod
+    def get_segment_key(audio_file_path, rate, start_ms, end_ms) -> str:
+        # The audio is identified by its content like in the decoded audio cache
+        return MarathonCache.hash_key("segment", AudioCache.get_key(audio_file_path), rate, start_ms, end_ms)
+
+    def get_segment(self, audio_file_path, rate, start_ms, end_ms) -> tuple[bytes, int, int, int] or None:
+        """
+        Get the rate changed and cropped audio of a map if it is in the cache
+
+        Parameters:
+        audio_file_path (str): The path of the original audio
+        rate (float): The rate the audio was changed to
+        start_ms (float): The start of the crop in the rate changed audio
+        end_ms (float): The end of the crop in the rate changed audio
+
+        Returns:
+        tuple[bytes, int, int, int]: The PCM data, frame rate, channels and sample width (None if it isn't cached)
+        """
+        return self.segment_cache.read(self.get_segment_key(audio_file_path, rate, start_ms, end_ms))
+
+    def put_segment(self, audio_file_path, rate, start_ms, end_ms, raw_data, frame_rate, channels,
+                    sample_width) -> None:
+        # Store the rate changed and cropped audio of a map
+        self.segment_cache.write(self.get_segment_key(audio_file_path, rate, start_ms, end_ms),
+                                 raw_data, frame_rate, channels, sample_width)
+
+    def clear(self) -> None:
+        self.segment_cache.clear()
+        for file_name in os.listdir(self.cache_directory):
+            if file_name.endswith(MAP_EXTENSION):
+                os.remove(join(self.cache_directory, file_name))
@@ -0,0 +1,152 @@
+from fractions import Fraction
+import numpy as np
+
+# Resampling qualities, from fastest to most accurate
+FAST_QUALITY = "fast"
+MEDIUM_QUALITY = "medium"
+HIGH_QUALITY = "high"
+# The number of input samples each output sample is computed from
+QUALITY_TAPS = {MEDIUM_QUALITY: 16, HIGH_QUALITY: 64}
+# Linear interpolation is as fast as the audioop path it replaced, the windowed sinc qualities are opt-in
+DEFAULT_QUALITY = FAST_QUALITY
+
+# The NumPy type of the samples for each sample width (24-bit samples have no NumPy type)
+SAMPLE_TYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+# The maximum number of filter phases. Rates are rounded to the closest ratio with at most this many.
+MAX_PHASES = 1000
+
+
+class Resampler:
+    # Class to resample PCM audio with NumPy
+    @staticmethod
+    def can_resample(sample_width) -> bool:
+        return sample_width in SAMPLE_TYPES
+
+    @staticmethod
+    def resample_raw_data(raw_data, sample_width, channels, source_rate, target_rate, quality=DEFAULT_QUALITY) -> bytes:
+        """
+        Resample raw PCM data
+
+        Parameters:
+        raw_data (bytes): The interleaved PCM data
+        sample_width (int): The sample width in bytes (1, 2 or 4)
+        channels (int): The number of channels
+        source_rate (int): The frame rate of the data
+        target_rate (int): The frame rate to resample to
+        quality (str): FAST_QUALITY, MEDIUM_QUALITY or HIGH_QUALITY
+
+        Returns:
+        bytes: The resampled PCM data with the same sample width and channels
+        """
+        samples = np.frombuffer(raw_data, dtype=SAMPLE_TYPES[sample_width]).reshape(-1, channels)
+        return Resampler.resample_samples(samples, source_rate, target_rate, quality).tobytes()
+
+    @staticmethod
+    def resample_samples(samples, source_rate, target_rate, quality=DEFAULT_QUALITY) -> np.ndarray:
+        """
+        Resample an array of integer samples to a new array of the same type
+
+        Parameters:
+        samples (np.ndarray): The samples as a (frames, channels) array of a type from SAMPLE_TYPES
+        source_rate (int): The frame rate of the samples
+        target_rate (int): The frame rate to resample to
+        quality (str): FAST_QUALITY, MEDIUM_QUALITY or HIGH_QUALITY
+
+        Returns:
+        np.ndarray: The resampled samples as a C-contiguous (frames, channels) array, so it can be written without a copy
+        """
+        resampled_samples = Resampler.resample(samples, source_rate, target_rate, quality)
+
+        # Round and clip back to the original sample type
+        type_info = np.iinfo(samples.dtype)
+        np.rint(resampled_samples, out=resampled_samples)
+        np.clip(resampled_samples, type_info.min, type_info.max, out=resampled_samples)
+        return resampled_samples.astype(samples.dtype, order='C')
+
+    @staticmethod
+    def resample(samples, source_rate, target_rate, quality=DEFAULT_QUALITY) -> np.ndarray:
+        """
+        Resample an array of samples with a polyphase filter
+
+        Parameters:
+        samples (np.ndarray): The samples as a (frames, channels) array
+        source_rate (int): The frame rate of the samples
+        target_rate (int): The frame rate to resample to
+        quality (str): FAST_QUALITY, MEDIUM_QUALITY or HIGH_QUALITY
+
+        Returns:
+        np.ndarray: The resampled samples as a floating point (frames, channels) array
+        """
+        frame_count, channels = samples.shape
+        output_frame_count = int(frame_count * target_rate / source_rate)
+        # float32 is precise enough for 8 and 16-bit samples and halves the memory used
+        work_type = np.float32 if samples.dtype.itemsize <= 2 else np.float64
+        if source_rate == target_rate or frame_count == 0:
+            return samples[:output_frame_count].astype(work_type)
+
+        # Output frame (q * up + phase) is read from input frame (q * down + phase * down / up).
+        # A small up keeps the number of phases low, at the cost of a negligible drift for rates that don't divide evenly.
+        ratio = Fraction(source_rate, target_rate).limit_denominator(MAX_PHASES)
+        down, up = ratio.numerator, ratio.denominator
+        taps = Resampler.get_taps(quality)
+        # Lower the cutoff when downsampling so the removed frequencies don't alias
+        cutoff = min(1.0, target_rate / source_rate)
+
+        # Pad the input so every tap of every output frame has a sample to read, even past the end
+        padding = -taps[0]
+        padded_frame_count = max(frame_count, (output_frame_count - 1) * down // up + 1) + padding + taps[-1] + 1
+        padded_samples = np.zeros((channels, padded_frame_count), dtype=work_type)
+        padded_samples[:, padding:padding + frame_count] = samples.T
+
+        output = np.empty((channels, output_frame_count), dtype=work_type)
+        for phase in range(min(up, output_frame_count)):
+            offset, remainder = divmod(phase * down, up)
+            weights = Resampler.get_weights(taps, remainder / up, cutoff, quality).astype(work_type)
+            phase_frame_count = len(range(phase, output_frame_count, up))
+
+            # Every output frame of a phase uses the same weights, so each tap is one strided multiply-add
+            phase_output = np.zeros((channels, phase_frame_count), dtype=work_type)
+            for tap, weight in zip(taps, weights):
+                start = offset + tap + padding
+                phase_output += padded_samples[:, start:start + down * (phase_frame_count - 1) + 1:down] * weight
+            output[:, phase::up] = phase_output
+
+        return output.T
+
+    @staticmethod
+    def get_taps(quality) -> np.ndarray:
+        # The input frames around the output position that each output frame is computed from
+        if quality == FAST_QUALITY:
+            return np.arange(0, 2)
+        half_taps = QUALITY_TAPS[quality] // 2
+        return np.arange(-half_taps + 1, half_taps + 1)
+
+    @staticmethod
+    def get_weights(taps, fraction, cutoff, quality) -> np.ndarray:
+        """
+        Get the filter weights of the taps for an output frame between two input frames
+
+        Parameters:
+        taps (np.ndarray): The taps from get_taps()
+        fraction (float): How far the output frame is past the input frame it starts at (0 <= fraction < 1)
+        cutoff (float): The cutoff frequency relative to the input's Nyquist frequency
+        quality (str): FAST_QUALITY, MEDIUM_QUALITY or HIGH_QUALITY
+
+        Returns:
+        np.ndarray: The weight of every tap
+        """
+        distances = fraction - taps
+        if quality == FAST_QUALITY:
+            # Linear interpolation between the two closest input frames
+            return 1 - np.abs(distances)
+
+        half_taps = len(taps) // 2
+        weights = cutoff * np.sinc(cutoff * distances) * Resampler.blackman_window(distances / half_taps)
+        # Normalize so the filter never changes the volume
+        return weights / weights.sum()
+
+    @staticmethod
+    def blackman_window(x) -> np.ndarray:
+        # Blackman window over -1 <= x <= 1, 0 outside of it
+        window = 0.42 + 0.5 * np.cos(np.pi * x) + 0.08 * np.cos(2 * np.pi * x)
+        return np.where(np.abs(x) <= 1, window, 0.0)
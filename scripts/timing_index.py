@@ -0,0 +1,173 @@
+import numpy as np
+
+# The typed columns of the TimingPoints section
+TIMING_POINT_TYPE = np.dtype([('time', '<f8'), ('beat_length', '<f8'), ('uninherited', '?')])
+# Beat lengths closer than this are counted as the same BPM in the histogram
+BEAT_LENGTH_PRECISION = 1
+
+
+class TimingIndex:
+    # Class to hold the timing points of a map as sorted arrays, so the BPM and slider velocity
+    # at any time are found with a binary search instead of scanning the TimingPoints section
+    def __init__(self, timing_points) -> None:
+        """
+        Create an index from typed timing points. Use from_section() to parse one from an .osu file.
+
+        Parameters:
+        timing_points (np.ndarray): The time, beat length and uninherited flag of every timing point (TIMING_POINT_TYPE)
+        """
+        # A stable sort keeps the order of the file for timing points at the same time
+        timing_points = timing_points[np.argsort(timing_points['time'], kind='stable')]
+        uninherited = timing_points['uninherited']
+        self.uninherited_times = timing_points['time'][uninherited]
+        self.beat_lengths = timing_points['beat_length'][uninherited]
+        self.inherited_times = timing_points['time'][~uninherited]
+        # Inherited timing points store the slider velocity as a negative percentage
+        self.slider_velocities = np.clip(-100 / timing_points['beat_length'][~uninherited], 0.1, 10)
+
+    def __len__(self) -> int:
+        return len(self.uninherited_times) + len(self.inherited_times)
+
+    @staticmethod
+    def parse_section(timing_points_section) -> np.ndarray:
+        """
+        Parse a TimingPoints section into typed timing points
+
+        Parameters:
+        timing_points_section (list): The TimingPoints section from the .osu file
+
+        Returns:
+        np.ndarray: The time, beat length and uninherited flag of every timing point (TIMING_POINT_TYPE)
+        """
+        rows = []
+        for line in timing_points_section:
+            line_elements = line.strip().split(',')
+            if len(line_elements) < 2 or line.startswith('['):
+                continue
+            # Timing points of old maps have no uninherited column and are all uninherited
+            uninherited = line_elements[6] == "1" if len(line_elements) > 6 else True
+            rows.append((float(line_elements[0]), float(line_elements[1]), uninherited))
+        return np.array(rows, dtype=TIMING_POINT_TYPE)
+
+    @staticmethod
+    def from_section(timing_points_section) -> "TimingIndex":
+        return TimingIndex(TimingIndex.parse_section(timing_points_section))
+
+    @property
+    def bpms(self) -> np.ndarray:
+        # The BPM of every uninherited timing point
+        return 60000 / np.abs(self.beat_lengths)
+
+    def get_uninherited_indices(self, times) -> np.ndarray:
+        # The uninherited timing point active at every time. Times before the first one use the first one, like osu! does.
+        if not len(self.uninherited_times):
+            raise ValueError("The map has no uninherited Timing Point!")
+        return np.maximum(np.searchsorted(self.uninherited_times, times, side='right') - 1, 0)
+
+    def get_beat_lengths_at(self, times) -> np.ndarray:
+        return self.beat_lengths[self.get_uninherited_indices(times)]
+
+    def get_bpm_at(self, time) -> float:
+        """
+        Get the BPM active at a time
+
+        Parameters:
+        time (float): The time in milliseconds
+
+        Returns:
+        float: The BPM of the uninherited timing point active at the time
+        """
+        return 60000 / abs(float(self.get_beat_lengths_at(time)))
+
+    def get_slider_velocities_at(self, times) -> np.ndarray:
+        """
+        Get the slider velocity multiplier active at every time
+
+        Parameters:
+        times (np.ndarray): The times in milliseconds
+
+        Returns:
+        np.ndarray: The multiplier of the inherited timing point active at every time (1 where an uninherited one reset it)
+        """
+        times = np.asarray(times, dtype=np.float64)
+        velocities = np.ones(times.shape)
+        if not len(self.inherited_times):
+            return velocities
+
+        inherited_indices = np.searchsorted(self.inherited_times, times, side='right') - 1
+        active = inherited_indices >= 0
+        # An uninherited timing point resets the slider velocity until the next inherited one
+        if len(self.uninherited_times):
+            uninherited_indices = np.searchsorted(self.uninherited_times, times, side='right') - 1
+            reset = (uninherited_indices >= 0) & (self.uninherited_times[np.maximum(uninherited_indices, 0)]
+                                                  > self.inherited_times[np.maximum(inherited_indices, 0)])
+            active &= ~reset
+        velocities[active] = self.slider_velocities[inherited_indices[active]]
+        return velocities
+
+    def get_slider_velocity_at(self, time) -> float:
+        return float(self.get_slider_velocities_at(time))
+
+    def group_beat_lengths(self, end_time=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Group the uninherited timing points by their rounded beat length. The map needs at least one of them.
+
+        Parameters:
+        end_time (float): The end of the map, usually the end of its last object.
+        (None ends the map at its last uninherited timing point)
+
+        Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The rounded beat length, the total duration in milliseconds
+        and the first timing point of every group
+        """
+        if end_time is None:
+            end_time = self.uninherited_times[-1]
+
+        # Every uninherited timing point lasts until the next one, the first one from the start of the map.
+        # Timing points after the end of the map don't count.
+        start_times = np.minimum(self.uninherited_times, end_time)
+        start_times[0] = 0
+        end_times = np.append(start_times[1:], max(end_time, start_times[-1]))
+        durations = end_times - start_times
+
+        beat_lengths, first_indices, groups = np.unique(np.round(np.abs(self.beat_lengths), BEAT_LENGTH_PRECISION),
+                                                        return_index=True, return_inverse=True)
+        return beat_lengths, np.bincount(groups, weights=durations, minlength=len(beat_lengths)), first_indices
+
+    def get_bpm_histogram(self, end_time=None) -> dict[float, float]:
+        """
+        Get how long every BPM of the map lasts
+
+        Parameters:
+        end_time (float): The end of the map, usually the end of its last object.
+        (None ends the map at its last uninherited timing point)
+
+        Returns:
+        dict[float, float]: The duration in milliseconds of every BPM, from the longest to the shortest
+        """
+        if not len(self.uninherited_times):
+            return {}
+        _, durations, first_indices = self.group_beat_lengths(end_time)
+        # Every group is named after the exact BPM of its first timing point
+        histogram = {60000 / abs(float(self.beat_lengths[first_index])): float(duration)
+                     for first_index, duration in zip(first_indices, durations)}
+        return dict(sorted(histogram.items(), key=lambda item: item[1], reverse=True))
+
+    def get_dominant_bpm(self, end_time=None) -> float:
+        """
+        Get the BPM that lasts the longest
+
+        Parameters:
+        end_time (float): The end of the map, usually the end of its last object.
+        (None ends the map at its last uninherited timing point)
+
+        Returns:
+        float: The exact BPM of the first timing point of the longest lasting group
+        """
+        if not len(self.uninherited_times):
+            raise ValueError("The map has no uninherited Timing Point!")
+        _, durations, first_indices = self.group_beat_lengths(end_time)
+        # Look at the groups in the order they appear in the map, so the earliest one wins a tie
+        map_order = np.argsort(first_indices)
+        dominant_index = first_indices[map_order[int(np.argmax(durations[map_order]))]]
+        return 60000 / abs(float(self.beat_lengths[dominant_index]))